@@ -1,682 +1,582 @@
-    from flask import Flask, request, render_template_string, render_template, jsonify
+from flask import (
+    Flask, Response, request, render_template, jsonify, send_file, send_from_directory,
+    stream_with_context
+)
+import os
+import time
+import uuid
+import json
+import shutil
+import logging
+import threading
+from werkzeug.exceptions import RequestEntityTooLarge
+# The app imports tables, assets, fonts and validation at startup for their
+# constants alone; those modules load fitz, numpy, pdfplumber, Pillow and
+# fontTools on first use, so only a conversion pays for them
+from validation import open_validated_pdf, format_page_range, MAX_FILE_SIZE_MB
+from intake import StreamingUploadRequest, UPLOAD_FOLDER, upload_lock
+from cache import ConversionCache, cache_key, hash_file
+from jobs import JobStore, path_size
+from scheduler import JobScheduler, QueueFull
+from assets import ASSET_FOLDER
+from compression import ENCODINGS, precompress, pick_variant
+from tables import TABLE_BACKEND, TABLE_BACKENDS
+from fonts import FONT_FOLDER, FONT_MIME_TYPES
+from metrics import JobMetrics, metrics_registry
+from writer import (
+    DocumentWriter, TARGET_WIDTH, PAGE_MANIFEST, PAGE_FONT_CSS, STALE_MARKER, page_file_name, page_files, assemble_documents
+)
+from edits import PatchError, patch_page, job_lock
+
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+app.request_class = StreamingUploadRequest
+OUTPUT_FOLDER = "output"
+# Write JSON without indentation (smaller and faster to produce)
+COMPACT_JSON = os.environ.get("COMPACT_JSON") == "1"
+# Load the conversion stack (fitz, pdfplumber, fontTools, numpy) and start
+# the page workers in the background at startup instead of on the first job
+PREWARM_CONVERSION = os.environ.get("PREWARM_CONVERSION") == "1"
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# Job status records (SQLite-backed, evicted by TTL and storage budget)
+job_store = JobStore()
+
+# Finished conversions keyed by PDF hash + converter settings
+conversion_cache = ConversionCache()
+
+# Bounded pool of conversion threads fed by a priority queue
+scheduler = JobScheduler()
+
+# Queue and cache state are sampled on every /metrics scrape
+metrics_registry.add_gauges("conversion_queue", scheduler.stats)
+metrics_registry.add_gauges("conversion_cache", conversion_cache.stats)
+
+
+def prewarm_conversion():
+    # A failed warm-up only costs the first job its head start
+    start = time.perf_counter()
+    try:
+        from converter import prewarm
+        for future in prewarm():
+            future.result()
+    except Exception as e:
+        logger.warning("Could not prewarm the conversion workers: %s", e)
+        return
+    logger.info("Conversion stack warmed in %.2fs", time.perf_counter() - start)
+
+
+if PREWARM_CONVERSION:
+    threading.Thread(target=prewarm_conversion, name="prewarm", daemon=True).start()
+
+def job_pages_dir(job_id):
+    return os.path.join(OUTPUT_FOLDER, "pages", job_id)
+
+
+def job_pdf_url(job_id):
+    # Comparison pages point here instead of embedding the PDF
+    return f"/pdf/{job_id}"
+
+
+# ---------- PDF CONVERSION ----------
+def job_documents(job_id):
+    # {artifact name: path} of a job's whole-document files. Precompressed
+    # variants are cached and deleted along with their documents.
+    documents = {
+        "document.html": os.path.join(OUTPUT_FOLDER, f"{job_id}.html"),
+        "document.json": os.path.join(OUTPUT_FOLDER, f"{job_id}.json"),
+        "compare.html": os.path.join(OUTPUT_FOLDER, f"{job_id}.compare.html")
+    }
+    documents.update({name + suffix: path + suffix
+                      for name, path in list(documents.items()) for suffix in ENCODINGS.values()})
+    return documents
+
+
+def job_cache_id(pdf_hash, page_numbers, table_backend):
+    # Covers every setting that changes the output
+    from converter import COMPACT_HTML
+    return cache_key(pdf_hash, target_width=TARGET_WIDTH, compact_json=COMPACT_JSON, compact_html=COMPACT_HTML,
+                     pages=format_page_range(page_numbers) if page_numbers else "all", tables=table_backend)
+
+
+def finish_from_cache(job_id, cache_id, job_metrics, count=True):
+    # Completes the job from a cached conversion; False on a miss
+    documents = job_documents(job_id)
+    pages_dir = job_pages_dir(job_id)
+    compare_path = documents["compare.html"]
+    with job_metrics.stage("cache"):
+        cached = conversion_cache.get(cache_id, count=count)
+        if not cached:
+            return False
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        # Copy rather than link: /edit rewrites the per-job files in place
+        os.makedirs(pages_dir, exist_ok=True)
+        for name, path in cached.items():
+            shutil.copyfile(path, documents.get(name) or os.path.join(pages_dir, name))
+        # The comparison page links this job's /pdf URL, so it is
+        # never cached; rebuild it from the cached page fragments
+        assemble_documents(pages_dir, None, compare_path, None, job_pdf_url(job_id))
+        precompress(compare_path)
+    finish_job(job_id, job_metrics, list(documents.values()) + [pages_dir], cached=True, progress=100,
+               status='completed', message='Loaded cached conversion', result_path=compare_path)
+    return True
+
+
+def convert_pdf_with_progress(filename, job_id, pdf_hash=None, pdf_doc=None, page_numbers=None,
+                              table_backend=TABLE_BACKEND, cache_checked=False):
+    # pdf_hash and pdf_doc come from upload intake when available, so the
+    # file is neither hashed nor opened again here. page_numbers (0-based)
+    # limits the job to a page range; None converts the whole document.
+    # table_backend names the tables.TABLE_BACKENDS entry used for detection.
+    # cache_checked: /convert already counted this job's cache lookup.
+    # The conversion modules are imported here, not at app startup.
     import fitz  # PyMuPDF
-    import pdfplumber
-    import os
-    import html
-    import re
-    import time
-    import base64
-    import threading
-    import uuid
-    from validation import validate_pdf
-    from io import BytesIO
-    from fontTools.ttLib import TTFont
-    from bs4 import BeautifulSoup
-    import json
-
-    app = Flask(__name__)
-    UPLOAD_FOLDER = "uploads"
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-    # Store conversion progress
-    conversion_progress = {}
-
-    # ---------- HTML → JSON HELPER ----------
-    def html_to_json(html_content, json_path):
-        soup = BeautifulSoup(html_content, "html.parser")
-        pages_data = []
-
-        for page_idx, page_div in enumerate(soup.select(".page-container"), start=1):
-            page_obj = {
-                "page_number": page_idx,
-                "elements": []
-            }
-
-            # Extract positioned text
-            for text_div in page_div.select(".positioned-text"):
-                style = text_div.get("style", "")
-                page_obj["elements"].append({
-                    "type": "text",
-                    "text": text_div.get_text(),
-                    "style": style
-                })
-
-            # Extract positioned images
-            for img_div in page_div.select(".positioned-image"):
-                img_tag = img_div.find("img")
-                if img_tag:
-                    style = img_div.get("style", "")
-                    src = img_tag.get("src", "")
-                    page_obj["elements"].append({
-                        "type": "image",
-                        "style": style,
-                        "src": src
-                    })
-
-            # Extract tables
-            for table in page_div.find_all("table"):
-                rows = []
-                for tr in table.find_all("tr"):
-                    row_data = []
-                    for td in tr.find_all("td"):
-                        cell_data = {
-                            "text": td.get_text(strip=True),
-                            "rowspan": td.get("rowspan"),
-                            "colspan": td.get("colspan")
-                        }
-                        row_data.append(cell_data)
-                    rows.append(row_data)
-                page_obj["elements"].append({
-                    "type": "table",
-                    "rows": rows
-                })
-
-            pages_data.append(page_obj)
-
-        json_data = {
-            "document": {
-                "pages": pages_data
-            }
-        }
-
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, indent=4, ensure_ascii=False)
-
-        return json_data
-
-    # ---------- FONT EXTRACTION ----------
-    def extract_fonts_as_css(pdf_doc):
-        css_rules = []
-        seen_fonts = {}
-        try:
-            for page in pdf_doc:
-                try:
-                    fonts = page.get_fonts(full=True)
-                except Exception as e:
-                    print(f"[Font list error on page {page.number}]: {e}")
-                    continue
-
-                for font in fonts:
-                    xref = font[0]
-                    internal_name = font[3]
-                    if not internal_name or internal_name in seen_fonts:
-                        continue
-                    try:
-                        ext, font_bytes, font_desc, font_name = pdf_doc.extract_font(xref)
-                        display_name = internal_name
-                        if isinstance(font_bytes, (bytes, bytearray)) and font_bytes:
-                            try:
-                                font_file = BytesIO(font_bytes)
-                                tt = TTFont(font_file)
-                                name_record = tt['name'].getName(4, 3, 1, 1033) or tt['name'].getName(4, 1, 0, 0)
-                                if name_record:
-                                    display_name = str(name_record)
-                            except Exception as e:
-                                print(f"[FontTools Error] Could not read full name for {internal_name}: {e}")
-                        else:
-                            print(f"[Font Extraction Warning] No embedded data for {internal_name}")
-
-                        normalized_display_name = re.sub(
-                            r'[, \-](bold|italic|oblique)', '', display_name, flags=re.IGNORECASE
-                        ).strip()
-                        seen_fonts[internal_name] = normalized_display_name
-
-                        if isinstance(font_bytes, (bytes, bytearray)) and font_bytes:
-                            mime_type = "font/woff" if ext.lower() == "woff" else "font/ttf"
-                            b64_font = base64.b64encode(font_bytes).decode("utf-8")
-                            css_rules.append(f"""
-                                @font-face {{
-                                    font-family: '{normalized_display_name}';
-                                    src: url(data:{mime_type};base64,{b64_font}) format('{ext.lower()}');
-                                }}
-                            """)
-                    except Exception as e:
-                        print(f"[Font Extraction Error] {internal_name}: {e}")
-
-        except Exception as e:
-            print(f"[extract_fonts_as_css Error]: {e}")
-        return "\n".join(css_rules), seen_fonts
-
-    # ---------- PDF CONVERSION ----------
-    def convert_pdf_with_progress(filename, job_id):
-        try:
-            conversion_progress[job_id] = {
-                'status': 'starting',
-                'progress': 0,
-                'message': 'Initializing conversion...',
-                'result': None,
-                'error': None,
-                'pdf_base64': None
-            }
-
-            start_time = time.time()
-            target_width = 960
-            full_html = ""
-
-            # Convert entire PDF to base64
-            with open(filename, 'rb') as pdf_file:
-                pdf_base64 = base64.b64encode(pdf_file.read()).decode('utf-8')
-                conversion_progress[job_id]['pdf_base64'] = pdf_base64
-
+    from converter import convert_pages_serial, convert_pages_parallel, use_parallel, COMPACT_HTML
+    from fonts import DocumentFonts
+    job_metrics = JobMetrics()
+    # Registered on failure too, so partial output is evicted with the job
+    artifacts = []
+    try:
+        job_store.create(job_id, pdf_path=filename)
+
+        start_time = time.time()
+        target_width = TARGET_WIDTH
+
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        output_path = os.path.join(OUTPUT_FOLDER, f"{job_id}.html")
+        json_path = os.path.join(OUTPUT_FOLDER, f"{job_id}.json")
+        compare_path = os.path.join(OUTPUT_FOLDER, f"{job_id}.compare.html")
+        pages_dir = job_pages_dir(job_id)
+        documents = job_documents(job_id)
+        artifacts = list(documents.values()) + [pages_dir]
+
+        # /convert already served hits it saw; this catches an identical job
+        # that finished while this one was queued
+        with job_metrics.stage("cache"):
+            cache_id = job_cache_id(pdf_hash or hash_file(filename), page_numbers, table_backend)
+        if finish_from_cache(job_id, cache_id, job_metrics, count=not cache_checked):
+            return
+
+        if pdf_doc is None:
             pdf_doc = fitz.open(filename)
-            pdf_plumber = pdfplumber.open(filename)
-            total_pages = len(pdf_doc)
-
-            font_css, font_name_map = extract_fonts_as_css(pdf_doc)
-            conversion_progress[job_id]['progress'] = 5
-
-            for page_num, (page_mupdf, page_plumber) in enumerate(zip(pdf_doc, pdf_plumber.pages)):
-                # Update progress
-                page_progress = int(5 + (page_num / total_pages) * 85)  # 5-90% for page processing
-                conversion_progress[job_id]['progress'] = page_progress
-                conversion_progress[job_id]['message'] = f'Processing page {page_num + 1} of {total_pages}...'
-
-                page_width = page_mupdf.rect.width
-                page_height = page_mupdf.rect.height
-                scale = target_width / page_width
-                elements = []
-
-                # Detect tables
-                tables = page_plumber.find_tables()
-                table_bboxes = [table.bbox for table in tables]
-
-                def is_within_table(x0, y0, x1, y1):
-                    for tb in table_bboxes:
-                        tx0, ty0, tx1, ty1 = tb
-                        if (x0 >= tx0 and x1 <= tx1 and y0 >= ty0 and y1 <= ty1):
-                            return True
-                    return False
-
-                # Find max text width for padding calc
-                blocks = page_mupdf.get_text("dict")["blocks"]
-                max_text_width = 0
-                for block in blocks:
-                    if block["type"] != 0:
-                        continue
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            text_width = span["bbox"][2] - span["bbox"][0]
-                            if text_width > max_text_width:
-                                max_text_width = text_width
-
-                # Text extraction with real fonts
-                for block in blocks:
-                    if block["type"] != 0:
-                        continue
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            x0, y0, x1, y1 = span["bbox"]
-                            if is_within_table(x0, y0, x1, y1):
-                                continue
-                            text = html.escape(span["text"])
-                            if not text.strip():
-                                continue
-
-                            font_size = round(span["size"] * scale, 1)
-                            font_color = "#{:06x}".format(span["color"])
-
-                            internal_font = span.get("font", "Arial")
-
-                            # Match to extracted font map considering original/raw names
-                            font_family = font_name_map.get(internal_font, internal_font)
-
-                            # As a backup, also try the normalized name in map
-                            if not font_name_map.get(internal_font, None):
-                                norm_name = re.sub(r'[, \-](bold|italic|oblique)', '', internal_font, flags=re.IGNORECASE).strip()
-                                font_family = font_name_map.get(norm_name, norm_name)
-
-                            # Now use font_family for CSS
-
-
-                            # Detect bold/italic from original internal name
-                            is_bold = "bold" in internal_font.lower()
-                            is_italic = "italic" in internal_font.lower() or "oblique" in internal_font.lower()
-
-                            LEFT_PADDING = 0.8
-                            RIGHT_PADDING = max(1.0, (page_width - max_text_width) * scale / 50)
-                            left = round(x0 * scale, 1) + LEFT_PADDING
-                            right = round((page_width - x1) * scale, 1) + RIGHT_PADDING
-
-                            # Preserve URLs inside text
-                            text = re.sub(r'(https?://[^\s<]+)', r'<a href="\1" target="_blank">\1</a>', text)
-
-                            style = (
-                                f"top: {round(y0 * scale, 1)}px; "
-                                f"left: {left}px; right: {right}px; "
-                                f"font-size: {font_size:.2f}px; "
-                                f"color: {font_color}; "
-                                f"font-family: '{font_family}', Arial, sans-serif; "
-                                f"{'font-weight: bold;' if is_bold else ''}"
-                                f"{'font-style: italic;' if is_italic else ''}"
-                                f"white-space: pre;"
-                            )
-
-
-                            elements.append(f'<div class="positioned-text" style="{style}">{text}</div>')
-
-                # Images
-                for img_index, img in enumerate(page_mupdf.get_images(full=True)):
-                    xref = img[0]
-                    pix = fitz.Pixmap(pdf_doc, xref)
-                    if pix.n >= 5:
-                        pix = fitz.Pixmap(fitz.csRGB, pix)
-                    img_bytes = pix.tobytes("png")
-                    img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                    rects = page_mupdf.get_image_rects(xref)
-                    for rect in rects:
-                        left = round(rect.x0 * scale, 1)
-                        top = round(rect.y0 * scale, 1)
-                        width = round((rect.x1 - rect.x0) * scale, 1)
-                        height = round((rect.y1 - rect.y0) * scale, 1)
-                        elements.append(f'''
-                            <div class="positioned-image" style="top: {top}px; left: {left}px; width: {width}px; height: {height}px;">
-                                <img src="data:image/png;base64,{img_base64}" style="width: 100%; height: 100%; object-fit: contain;">
-                            </div>
-                        ''')
-
-
-                # Process tables (unchanged)
-                for table in page_plumber.find_tables():
-                    if not table.cells:
-                        continue
-                    x0, top, x1, bottom = table.bbox
-                    width = (x1 - x0) * scale
-                    height = (bottom - top) * scale
-                    top_scaled = top * scale
-                    left_scaled = x0 * scale
-
-                    table_data = table.extract()
-                    if not table_data:
-                        continue
-
-                    rows = len(table_data)
-                    cols = max(len(row) for row in table_data) if table_data else 0
-                    grid = [[None for _ in range(cols)] for _ in range(rows)]
-                    occupied = set()
-
-                    for row_idx, row in enumerate(table_data):
-                        col_idx = 0
-                        for cell_idx, cell in enumerate(row):
-                            while (row_idx, col_idx) in occupied:
-                                col_idx += 1
-                            if col_idx >= cols:
-                                break
-                            if cell is None:
-                                continue
-
-                            rowspan = 1
-                            colspan = 1
-
-                            if cell_idx < len(row) - 1 and row[cell_idx + 1] is None:
-                                next_col = col_idx + 1
-                                while next_col < cols and (row_idx, next_col) not in occupied and (next_col >= len(row) or row[next_col] is None):
-                                    colspan += 1
-                                    next_col += 1
-
-                            if row_idx < len(table_data) - 1 and len(table_data[row_idx + 1]) > col_idx and table_data[row_idx + 1][col_idx] is None:
-                                next_row = row_idx + 1
-                                while next_row < rows and (next_row, col_idx) not in occupied and (col_idx >= len(table_data[next_row]) or table_data[next_row][col_idx] is None):
-                                    rowspan += 1
-                                    next_row += 1
-
-                            for r in range(row_idx, row_idx + rowspan):
-                                for c in range(col_idx, col_idx + colspan):
-                                    if r < rows and c < cols:
-                                        occupied.add((r, c))
-
-                            grid[row_idx][col_idx] = {
-                                'content': html.escape(cell or ""),
-                                'rowspan': rowspan if rowspan > 1 else None,
-                                'colspan': colspan if colspan > 1 else None
-                            }
-                            col_idx += colspan
-
-                    table_html = "<table>"
-                    for r_idx in range(rows):
-                        table_html += "<tr>"
-                        for c_idx in range(cols):
-                            if (r_idx, c_idx) in occupied and grid[r_idx][c_idx] is None:
-                                continue
-                            cell = grid[r_idx][c_idx]
-                            if cell:
-                                attributes = ""
-                                if cell['rowspan']:
-                                    attributes += f' rowspan="{cell["rowspan"]}"'
-                                if cell['colspan']:
-                                    attributes += f' colspan="{cell["colspan"]}"'
-                                table_html += f"<td{attributes}>{cell['content']}</td>"
-                            else:
-                                table_html += "<td></td>"
-                        table_html += "</tr>"
-                    table_html += "</table>"
-
-                    elements.append(f"""
-                    <div style="position: absolute; top: {top_scaled}px; left: {left_scaled}px;
-                                width: {width}px; height: {height}px;">
-                        {table_html}
-                    </div>
-                    """)
-
-                full_html += f'''
-                <div class="page-container" style="height: {int(page_height * scale)}px;">
-                    {"".join(elements)}
-                </div>
-                '''
-
-            # Finalizing
-            conversion_progress[job_id]['progress'] = 95
-            conversion_progress[job_id]['message'] = 'Finalizing HTML output...'
-            pdf_plumber.close()
-            conversion_time = round(time.time() - start_time, 2)
-            print(font_css)
-            # Create comparison view HTML
-            final_html = f'''
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="utf-8">
-                <title>PDF to HTML Comparison</title>
-                <style>
-                    {font_css}
-                    body {{
-                        font-family: Arial, sans-serif;
-                        margin: 0;
-                        padding: 0;
-                        background: #f5f5f5;
-                    }}
-                    .header {{
-                        padding: 15px;
-                        background-color: #2c3e50;
-                        color: white;
-                        text-align: center;
-                        font-size: 18px;
-                        font-weight: bold;
-                    }}
-                    .info-bar {{
-                        padding: 12px;
-                        font-size: 14px;
-                        background-color: #ecf0f1;
-                        border-bottom: 1px solid #bdc3c7;
-                        font-family: monospace;
-                        text-align: center;
-                    }}
-                    .comparison-container {{
-                        display: flex;
-                        height: calc(100vh - 120px);
-                    }}
-                    .pdf-panel, .html-panel {{
-                        width: 50%;
-                        border: 2px solid #34495e;
-                        overflow: auto;
-                    }}
-                    .panel-header {{
-                        background-color: #34495e;
-                        color: white;
-                        padding: 10px;
-                        text-align: center;
-                        font-weight: bold;
-                        position: sticky;
-                        top: 0;
-                        z-index: 100;
-                    }}
-                    .pdf-content {{
-                        padding: 20px;
-                        text-align: center;
-                        background: white;
-                    }}
-                    .pdf-embed {{
-                        width: 100%;
-                        height: 800px;
-                        border: none;
-                    }}
-                    .html-content {{
-                        background: #eee;
-                        min-height: 100%;
-                    }}
-                    .page-container {{
-                        position: relative;
-                        margin: 30px auto;
-                        background: white;
-                        border: 1px solid #ccc;
-                        box-shadow: 0 0 10px rgba(0,0,0,0.1);
-                        width: {target_width}px;
-                    }}
-                    .positioned-text {{
-                        position: absolute;
-                        white-space: pre;
-                        text-decoration: none;
-                    }}
-                    .positioned-text a {{
-                        color: blue;
-                        text-decoration: underline;
-                    }}
-                    .positioned-image {{
-                        position: absolute;
-                        object-fit: contain;
-                    }}
-                    table {{
-                        border-collapse: collapse;
-                        width: 100%;
-                        height: 100%;
-                    }}
-                    table td {{
-                        border: 1px solid #000;
-                        padding: 4px;
-                        vertical-align: top;
-                        font-size: 12px;
-                    }}
-                </style>
-                <script>
-                    const t0 = performance.now();
-                    window.onload = () => {{
-                        const t1 = performance.now();
-                        document.getElementById("render-time").innerText = (t1 - t0).toFixed(2) + " ms";
-                        const pdfPanel = document.querySelector('.pdf-panel');
-                        const htmlPanel = document.querySelector('.html-panel');
-                        let isScrollingPdf = false;
-                        let isScrollingHtml = false;
-                        pdfPanel.addEventListener('scroll', () => {{
-                            if (isScrollingHtml) return;
-                            isScrollingPdf = true;
-                            const ratio = pdfPanel.scrollTop / (pdfPanel.scrollHeight - pdfPanel.clientHeight);
-                            htmlPanel.scrollTop = ratio * (htmlPanel.scrollHeight - htmlPanel.clientHeight);
-                            setTimeout(() => isScrollingPdf = false, 50);
-                        }});
-                        htmlPanel.addEventListener('scroll', () => {{
-                            if (isScrollingPdf) return;
-                            isScrollingHtml = true;
-                            const ratio = htmlPanel.scrollTop / (htmlPanel.scrollHeight - htmlPanel.clientHeight);
-                            pdfPanel.scrollTop = ratio * (pdfPanel.scrollHeight - pdfPanel.clientHeight);
-                            setTimeout(() => isScrollingHtml = false, 50);
-                        }});
-                    }};
-                </script>
-            </head>
-            <body>
-                <div class="header">PDF to HTML Conversion Comparison</div>
-                <div class="info-bar">
-                    <b>Conversion time:</b> {conversion_time} seconds |
-                    <b>Render time:</b> <span id="render-time">...</span> |
-                    <b>Pages:</b> {total_pages}
-                </div>
-                <div class="comparison-container">
-                    <div class="pdf-panel">
-                        <div class="panel-header">Original PDF</div>
-                        <div class="pdf-content">
-                            <embed class="pdf-embed" src="data:application/pdf;base64,{pdf_base64}" type="application/pdf" />
-                        </div>
-                    </div>
-                    <div class="html-panel">
-                        <div class="panel-header">Converted HTML</div>
-                        <div class="html-content">
-                            {full_html}
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            '''
-
-            clean_html = f"""
-                    <!DOCTYPE html>
-                    <html>
-                    <head>
-                        <meta charset="utf-8">
-                        <title>Converted PDF (Clean)</title>
-                        <style>
-                            {font_css}
-                            body {{
-                                font-family: Arial, sans-serif;
-                                margin: 0;
-                                padding: 20px;
-                                background: #f5f5f5;
-                            }}
-                            .page-container {{
-                                position: relative;
-                                margin: 30px auto;
-                                background: white;
-                                border: 1px solid #ccc;
-                                box-shadow: 0 0 10px rgba(0,0,0,0.1);
-                                width: {target_width}px;
-                            }}
-                            .positioned-text {{
-                                position: absolute;
-                                white-space: pre;
-                                text-decoration: none;
-                            }}
-                            .positioned-text a {{
-                                color: blue;
-                                text-decoration: underline;
-                            }}
-                            .positioned-image {{
-                                position: absolute;
-                                object-fit: contain;
-                            }}
-                            table {{
-                                border-collapse: collapse;
-                                width: 100%;
-                                height: 100%;
-                            }}
-                            table td {{
-                                border: 1px solid #000;
-                                padding: 4px;
-                                vertical-align: top;
-                                font-size: 12px;
-                            }}
-                        </style>
-                    </head>
-                    <body>
-                        {full_html}
-                    </body>
-                    </html>
-                    """
-
-            output_dir = "output"
-            os.makedirs(output_dir, exist_ok=True)
-            output_filename = f"{job_id}.html"
-            output_path = os.path.join(output_dir, output_filename)
-
-
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(clean_html)
-            # Save JSON alongside HTML
-            json_path = os.path.join(output_dir, f"{job_id}.json")
-
-            
-            html_to_json(clean_html, json_path)
-            conversion_progress[job_id]['progress'] = 100
-            conversion_progress[job_id]['status'] = 'completed'
-            conversion_progress[job_id]['message'] = f'Conversion completed in {conversion_time} seconds'
-            conversion_progress[job_id]['result'] = final_html
-
-        except Exception as e:
-            conversion_progress[job_id]['status'] = 'error'
-            conversion_progress[job_id]['error'] = str(e)
-            conversion_progress[job_id]['message'] = f'Error: {str(e)}'
-
-
-    @app.route('/')
-    def upload_form():
-        return render_template('index.html')
-
-
-    @app.route('/convert', methods=['POST'])
-    def convert_pdf():
-        uploaded_file = request.files['pdf']
-        filename = os.path.join(UPLOAD_FOLDER, uploaded_file.filename)
-        uploaded_file.save(filename)
-        errors = validate_pdf(filename)
-        if errors:
+        if page_numbers is None:
+            page_numbers = list(range(len(pdf_doc)))
+        total_pages = len(page_numbers)
+
+        job_store.notify(job_id, stage='fonts', total_pages=total_pages)
+        with job_metrics.stage("fonts"):
+            document_fonts = DocumentFonts(pdf_doc)
+        font_name_map = document_fonts.name_map
+        job_store.update(job_id, progress=5)
+
+        # Placeholder heights for the lazy viewer, same scaling as convert_page
+        page_heights = []
+        for page_num in page_numbers:
+            rect = pdf_doc[page_num].rect
+            page_heights.append(int(rect.height * target_width / rect.width))
+
+        def on_page(done, total):
+            job_store.notify(job_id, page=done)
+            job_store.update(job_id, progress=int(5 + (done / total) * 85),  # 5-90% for page processing
+                             message=f'Processed page {done} of {total}...')
+
+        def on_stage(stage, page_number):
+            job_store.notify(job_id, stage=stage, page=page_number)
+
+        # Pages are written to the clean, comparison and JSON outputs as they finish
+        writer = DocumentWriter(output_path, compare_path, json_path, job_pdf_url(job_id), target_width,
+                                total_pages, pages_dir, page_heights, compact_json=COMPACT_JSON,
+                                compact_html=COMPACT_HTML, page_numbers=[page_num + 1 for page_num in page_numbers])
+
+        def write_page(page):
+            job_metrics.add_page(page)
+            document_fonts.add_chars(page.font_chars)
+            with job_metrics.stage("write"):
+                writer.write_page(page)
+            # The viewer can fetch /result/<job_id>/page/<n> from now on
+            job_store.notify(job_id, pages_ready=writer.page_count)
+        try:
+            if use_parallel(total_pages):
+                # Stages run inside pool workers; only per-page events reach us
+                job_store.notify(job_id, stage='pages')
+                pages_skipped = convert_pages_parallel(filename, page_numbers, font_name_map, target_width,
+                                                       write_page, on_page, table_backend)
+            else:
+                pages_skipped = convert_pages_serial(pdf_doc, filename, font_name_map, target_width,
+                                                     write_page, on_page, on_stage, page_numbers=page_numbers,
+                                                     table_backend=table_backend)
+            job_metrics.counters["table_pages_skipped"] = pages_skipped
+        except Exception:
+            writer.abort()
+            raise
+
+        # Finalizing
+        job_store.notify(job_id, stage='serialize')
+        job_store.update(job_id, progress=95, message='Finalizing HTML output...')
+        pdf_doc.close()
+        pdf_doc = None
+        conversion_time = round(time.time() - start_time, 2)
+        # Fonts are subset to the characters the pages actually used
+        with job_metrics.stage("font_subset"):
+            font_css = document_fonts.css()
+        with job_metrics.stage("write"):
+            writer.close(conversion_time, font_css)
+        # Compressed once here rather than on every request
+        with job_metrics.stage("compress"):
+            for path in (output_path, json_path, compare_path):
+                precompress(path)
+
+        with job_metrics.stage("cache"):
+            written = {name: path for name, path in documents.items()
+                       if os.path.exists(path) and not name.startswith("compare.html")}
+            conversion_cache.put(cache_id, dict(written, **page_files(pages_dir)))
+        finish_job(job_id, job_metrics, artifacts, progress=100, status='completed',
+                   message=f'Conversion completed in {conversion_time} seconds', result_path=compare_path)
+
+    except Exception as e:
+        finish_job(job_id, job_metrics, artifacts, status='error', error=str(e), message=f'Error: {str(e)}')
+    finally:
+        # The job owns the document /convert opened, whatever happens to it
+        if pdf_doc is not None:
+            pdf_doc.close()
+
+
+def finish_job(job_id, job_metrics, artifacts, cached=False, **fields):
+    # Attach the job's stage timings and counters to its record and fold them
+    # into the /metrics aggregates
+    job_metrics.counters["bytes_emitted"] = sum(path_size(path) for path in artifacts)
+    if artifacts:
+        fields["artifacts"] = artifacts
+    job_store.update(job_id, metrics=job_metrics.to_json(), **fields)
+    metrics_registry.observe_job(job_metrics, fields["status"], cached=cached)
+
+
+@app.route('/')
+def upload_form():
+    return render_template('index.html')
+
+
+def discard_job(job_id, filename):
+    # Drops a job that never ran, and its upload unless other jobs use the
+    # same bytes (uploads are stored once per content hash)
+    with upload_lock(filename):
+        job_store.delete(job_id)
+        if not job_store.uses_pdf(filename):
+            os.remove(filename)
+
+
+@app.route('/convert', methods=['POST'])
+def convert_pdf():
+    # The body was streamed into uploads/ (size-capped and hashed) while
+    # request.files was parsed; see intake.StreamingUploadRequest
+    upload = request.files['pdf'].stream
+    # Optional table detection backend, e.g. table_backend=pymupdf. Checked
+    # before the upload is stored, so the unstored file is simply dropped.
+    table_backend = request.form.get('table_backend', '').strip() or TABLE_BACKEND
+    if table_backend not in TABLE_BACKENDS:
+        return jsonify({
+            'status': 'error',
+            'message': f"Unknown table backend '{table_backend}' (choose from {', '.join(TABLE_BACKENDS)})"
+        }), 400  # Bad request
+    # The job row is recorded before the file is stored, so a request
+    # rejecting the same bytes meanwhile sees it in use and keeps the file
+    job_id = str(uuid.uuid4())
+    with upload_lock(upload.stored_path):
+        job_store.create(job_id, status='queued', message='Waiting in queue...', pdf_path=upload.stored_path)
+        filename = upload.store()
+    # Optional page range, e.g. pages=100-150 or pages=1-3,10-12
+    pdf_doc, page_numbers, errors = open_validated_pdf(filename, request.form.get('pages', '').strip())
+    if errors:
+        discard_job(job_id, filename)
+        return jsonify({
+            'status': 'error',
+            'message': ' | '.join(errors)
+        }), 400  # Bad request
+    if len(page_numbers) == len(pdf_doc):
+        page_numbers = None  # the whole document: shares its cache entry with plain uploads
+    # Cache hits are served here rather than waiting behind conversions
+    if finish_from_cache(job_id, job_cache_id(upload.sha256, page_numbers, table_backend), JobMetrics()):
+        pdf_doc.close()
+        return jsonify({'status': 'ok', 'job_id': job_id, 'queue_position': 0})
+    # Lower runs first; clients may only lower their own job's place, never
+    # jump ahead of the default
+    priority = max(0, request.form.get('priority', 0, type=int))
+    try:
+        scheduler.submit(job_id, convert_pdf_with_progress, filename, job_id, upload.sha256, pdf_doc,
+                         page_numbers, table_backend, True, priority=priority)  # cache_checked
+    except QueueFull as e:
+        pdf_doc.close()
+        discard_job(job_id, filename)
+        response = jsonify({'status': 'busy', 'message': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503  # Service unavailable
+    return jsonify({'status': 'ok', 'job_id': job_id, 'queue_position': scheduler.position(job_id)})
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    # Raised from the Content-Length check or part-way through the upload
+    return jsonify({'status': 'error', 'message': f"File size exceeds {MAX_FILE_SIZE_MB} MB"}), 413
+
+
+def with_queue_position(job_id, payload):
+    if payload['status'] == 'queued':
+        payload['queue_position'] = scheduler.position(job_id)
+        if payload['queue_position']:
+            payload['message'] = f"Waiting in queue (position {payload['queue_position']})..."
+    return payload
+
+
+@app.route('/progress/<job_id>')
+def get_progress(job_id):
+    payload = job_store.progress(job_id)
+    if payload:
+        return jsonify(with_queue_position(job_id, payload))
+    else:
+        return jsonify({'status': 'not_found', 'error': 'Job not found'}), 404
+
+
+@app.route('/progress/<job_id>/events')
+def stream_progress(job_id):
+    # Server-Sent Events: one small JSON event per change, comments as keepalive
+    if job_id not in job_store:
+        return jsonify({'status': 'not_found', 'error': 'Job not found'}), 404
+
+    def events():
+        last = None
+        for payload in job_store.watch(job_id):
+            payload = with_queue_position(job_id, payload)
+            if payload == last:
+                yield ": keepalive\n\n"
+                continue
+            last = payload
+            yield f"data: {json.dumps(payload)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/assets/<path:name>')
+def get_asset(name):
+    # Asset names are content hashes, so they can be cached forever
+    return send_from_directory(os.path.abspath(ASSET_FOLDER), name, max_age=31536000)
+
+
+@app.route('/fonts/<path:name>')
+def get_font(name):
+    # Font assets are named by content hash, so they can be cached forever
+    ext = name.rsplit(".", 1)[-1]
+    return send_from_directory(os.path.abspath(FONT_FOLDER), name, max_age=31536000,
+                               mimetype=FONT_MIME_TYPES.get(ext, "application/octet-stream"))
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/<job_id>')
+def job_metrics_view(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'status': 'not_found', 'error': 'Job not found'}), 404
+    return jsonify(job['metrics'])
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(conversion_cache.stats())
+
+
+@app.route('/queue/stats')
+def queue_stats():
+    return jsonify(scheduler.stats())
+
+@app.route('/edit/<job_id>/page/<int:page_number>', methods=['PATCH'])
+def patch_page_view(job_id, page_number):
+    # Small edits: {"element": i, "text": ..., "style": ...} or a list of them,
+    # where i indexes the elements of the JSON page whose page_number is
+    # page_number (page-range jobs keep source numbering, so page 120 of a
+    # 100-150 job is document.pages[20])
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'status': 'not_found', 'error': 'Job not found'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'status': 'error', 'error': f"Conversion not completed. Status: {job['status']}"}), 400
+    patches = request.get_json(silent=True)
+    if isinstance(patches, dict):
+        patches = [patches]
+    if not patches or not isinstance(patches, list) or not all(isinstance(patch, dict) for patch in patches):
+        return jsonify({'status': 'error', 'error': 'Expected a patch object or a list of them'}), 400
+    start = time.perf_counter()
+    try:
+        elements = patch_page(job_pages_dir(job_id), page_number, patches)
+    except PatchError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 400
+    metrics_registry.stage_seconds.observe(time.perf_counter() - start, stage="patch")
+    return jsonify({'status': 'ok', 'page': page_number, 'elements': elements})
+
+
+def ensure_assembled(job_id, job):
+    # Whole-document files are rebuilt lazily, the first time they are read
+    # after page edits
+    pages_dir = job_pages_dir(job_id)
+    stale_path = os.path.join(pages_dir, STALE_MARKER)
+    if not os.path.exists(stale_path):
+        return
+    with job_lock(pages_dir):
+        if os.path.exists(stale_path):
+            documents = (os.path.join(OUTPUT_FOLDER, f"{job_id}.html"), job['result_path'],
+                         os.path.join(OUTPUT_FOLDER, f"{job_id}.json"))
+            assemble_documents(pages_dir, *documents, job_pdf_url(job_id), COMPACT_JSON)
+            for path in documents:
+                precompress(path)
+
+
+@app.route('/edit/<job_id>', methods=['GET', 'POST'])
+def edit_html(job_id):
+    html_file = os.path.join(OUTPUT_FOLDER, f"{job_id}.html")
+    json_file = os.path.join(OUTPUT_FOLDER, f"{job_id}.json")
+    job = job_store.get(job_id)
+    if job and job['status'] == 'completed':
+        ensure_assembled(job_id, job)
+
+    if request.method == 'POST':
+        if os.path.exists(os.path.join(job_pages_dir(job_id), PAGE_MANIFEST)):
+            # The pages, their models and the comparison view would keep the
+            # old content, and the next page edit would overwrite this one
             return jsonify({
                 'status': 'error',
-                'message': ' | '.join(errors)
-            }), 400  # Bad request
-        job_id = str(uuid.uuid4())
-        thread = threading.Thread(target=convert_pdf_with_progress, args=(filename, job_id))
-        thread.daemon = True
-        thread.start()
-        return jsonify({'status': 'ok', 'job_id': job_id})
-
-
-    @app.route('/progress/<job_id>')
-    def get_progress(job_id):
-        if job_id in conversion_progress:
-            return jsonify(conversion_progress[job_id])
-        else:
-            return jsonify({'status': 'not_found', 'error': 'Job not found'}), 404
-
-    @app.route('/edit/<job_id>', methods=['GET', 'POST'])
-    def edit_html(job_id):
-        output_dir = "output"
-        html_file = os.path.join(output_dir, f"{job_id}.html")
-        json_file = os.path.join(output_dir, f"{job_id}.json")
-
-        if request.method == 'POST':
-            edited_html = request.form['edited_html']
-            # Save HTML
-            with open(html_file, "w", encoding="utf-8") as f:
-                f.write(edited_html)
-            # Update JSON
-            html_to_json(edited_html, json_file)
-            return "Changes saved! <a href='/compare/{}'>Go back</a>".format(job_id)
-        
-        # GET: Load HTML for editing
-        if os.path.exists(html_file):
-            with open(html_file, encoding="utf-8") as f:
-                html_content = f.read()
-        else:
-            html_content = ""
-        return render_template('editor.html', job_id=job_id, html_content=html_content)
+                'error': f"Edit pages with PATCH /edit/{job_id}/page/<n>; whole-document edits are not supported"
+            }), 409  # Conflict
+        edited_html = request.form['edited_html']
+        # Save HTML
+        with open(html_file, "w", encoding="utf-8") as f:
+            f.write(edited_html)
+        # Update JSON
+        from converter import html_to_json
+        start = time.perf_counter()
+        html_to_json(edited_html, json_file)
+        metrics_registry.stage_seconds.observe(time.perf_counter() - start, stage="html_to_json")
+        precompress(html_file)
+        precompress(json_file)
+        return "Changes saved! <a href='/compare/{}'>Go back</a>".format(job_id)
+    
+    # GET: Load HTML for editing
+    if os.path.exists(html_file):
+        with open(html_file, encoding="utf-8") as f:
+            html_content = f.read()
+    else:
+        html_content = ""
+    return render_template('editor.html', job_id=job_id, html_content=html_content)
+
+
+@app.route('/compare/<job_id>')
+def compare_view(job_id):
+    progress = job_store.get(job_id)
+    if progress:
+        if progress['status'] == 'completed':
+            # Both sides load by URL: the PDF through /pdf (Range requests, so
+            # the browser renders as it downloads), the HTML through the viewer
+            page_num = request.args.get('page', 1, type=int)
+            return render_template('compare.html',
+                    page_num=page_num,
+                    pdf_url=f"{job_pdf_url(job_id)}#page={page_num}",
+                    html_url=f"/view/{job_id}",
+                    job_id=job_id)
 
-
-    @app.route('/compare/<job_id>')
-    def compare_view(job_id):
-        if job_id in conversion_progress:
-            progress = conversion_progress[job_id]
-            if progress['status'] == 'completed':
-                return render_template('compare.html',
-                        pdf_base64=progress['pdf_base64'],
-                        html_content=progress['result'],
-                        job_id=job_id)
-
-            else:
-                return f"Conversion not completed. Status: {progress['status']}", 400
         else:
-            return "Job not found", 404
-
-
-    @app.route('/result/<job_id>')
-    def get_result(job_id):
-        if job_id in conversion_progress:
-            progress = conversion_progress[job_id]
-            if progress['status'] == 'completed':
-                del conversion_progress[job_id]
-                return render_template_string(progress['result'])
-            else:
-                return f"Conversion not completed. Status: {progress['status']}", 400
+            return f"Conversion not completed. Status: {progress['status']}", 400
+    else:
+        return "Job not found", 404
+
+
+@app.route('/pdf/<job_id>')
+def get_pdf(job_id):
+    # The stored upload, streamed from disk (sendfile where the server
+    # supports it) with Range and conditional GET support. Uploads are
+    # content-addressed and never change, so clients may cache them.
+    job = job_store.get(job_id)
+    if job is None or not job['pdf_path'] or not os.path.exists(job['pdf_path']):
+        return "PDF not found", 404
+    return send_file(os.path.abspath(job['pdf_path']), mimetype='application/pdf', conditional=True,
+                     max_age=31536000)
+
+
+@app.route('/view/<job_id>')
+def view_result(job_id):
+    # Lazy viewer: lays out one placeholder per page and fetches each page
+    # fragment as it scrolls into view, while the conversion is still running
+    manifest = read_page_manifest(job_id)
+    if manifest is None:
+        return "Job not found", 404
+    return render_template('viewer.html', job_id=job_id, **manifest)
+
+
+def read_page_manifest(job_id):
+    path = os.path.join(job_pages_dir(job_id), PAGE_MANIFEST)
+    if job_id not in job_store or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def send_artifact(path, mimetype):
+    # Static bytes in the best precompressed encoding the client accepts.
+    # The ETag comes from the identity file, so it changes whenever the
+    # artifact is rewritten; with no-cache, repeat views revalidate to a 304.
+    stat = os.stat(path)
+    send_path, encoding = pick_variant(path, request.accept_encodings)
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}" + (f"-{encoding}" if encoding else "")
+    response = send_file(os.path.abspath(send_path), mimetype=mimetype, etag=etag, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/result/<job_id>/page/<int:page_number>')
+def get_result_page(job_id, page_number):
+    progress = job_store.progress(job_id)
+    if progress is None:
+        return jsonify({'status': 'not_found', 'error': 'Job not found'}), 404
+    pages_dir = os.path.abspath(job_pages_dir(job_id))
+    if os.path.exists(os.path.join(pages_dir, page_file_name(page_number))):
+        return send_artifact(os.path.join(pages_dir, page_file_name(page_number)), 'text/html')
+    if progress['status'] in ('completed', 'error'):
+        return jsonify({'status': progress['status'], 'error': 'Page not found'}), 404
+    # Not converted yet: the viewer retries when pages_ready moves past it
+    response = jsonify(progress)
+    response.status_code = 202
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@app.route('/result/<job_id>/fonts.css')
+def get_result_fonts(job_id):
+    # Written once the last page is done; fragments use fallback fonts until then
+    pages_dir = os.path.abspath(job_pages_dir(job_id))
+    if job_id not in job_store or not os.path.exists(os.path.join(pages_dir, PAGE_FONT_CSS)):
+        return "Fonts not ready", 404
+    return send_artifact(os.path.join(pages_dir, PAGE_FONT_CSS), 'text/css')
+
+
+@app.route('/result/<job_id>')
+def get_result(job_id):
+    progress = job_store.get(job_id)
+    if progress:
+        if progress['status'] == 'completed':
+            # Kept until the job store evicts it, so the result can be reloaded
+            ensure_assembled(job_id, progress)
+            # Served as stored: converted text is never run through Jinja
+            return send_artifact(progress['result_path'], 'text/html')
         else:
-            return "Job not found", 404
+            return f"Conversion not completed. Status: {progress['status']}", 400
+    else:
+        return "Job not found", 404
 
 
-    if __name__ == '__main__':
-        app.run(debug=True)
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    app.run(debug=True)
@@ -0,0 +1,174 @@
+import os
+import io
+import math
+import hashlib
+from writer import write_bytes_atomic
+# fitz and Pillow are imported on first use, when an image is stored
+
+ASSET_FOLDER = os.path.join("output", "assets")
+ASSET_URL_PREFIX = "/assets/"
+
+# Images are resampled to the size they are drawn at on the page, times this
+# device pixel ratio; 1.5 stays sharp on most screens, 2 for retina-grade
+IMAGE_DPR = float(os.environ.get("IMAGE_DPR", 1.5))
+# Target sizes are rounded up to a multiple of this many pixels, so an image
+# drawn at slightly different sizes shares one asset
+IMAGE_SIZE_STEP = 32
+# Resampling (and, for JPEGs, re-encoding) only pays off when it removes a
+# good share of the pixels; below that the native image is kept
+MAX_RESAMPLED_AREA = 0.5
+# Photographic content is lossy-encoded as "jpeg" or "webp"; line art,
+# text and flat graphics stay PNG. WebP is about a third smaller than JPEG
+# but takes twice as long to encode.
+PHOTO_FORMAT = os.environ.get("IMAGE_PHOTO_FORMAT", "jpeg")
+PHOTO_QUALITY = int(os.environ.get("IMAGE_PHOTO_QUALITY", 80))
+# libwebp effort 0-6: 1 is about 3x faster than the default 4 and only a few
+# percent bigger
+WEBP_METHOD = 1
+PNG_COMPRESS_LEVEL = 3
+# More distinct colors than this (in a downsampled copy) counts as a photo
+LINE_ART_MAX_COLORS = 256
+FORMAT_EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png"}
+
+# Formats browsers render as-is; anything else is re-encoded.
+# JPX (JPEG 2000) is left out on purpose: only Safari can display it.
+PASSTHROUGH_FORMATS = {"jpeg": "jpg"}
+
+
+# ---------- IMAGE ENCODING ----------
+def target_size(native_width, native_height, display_width, display_height, dpr=IMAGE_DPR):
+    # Pixel size to encode at: enough for the displayed box at `dpr`, never
+    # upscaled, aspect ratio kept (the viewer draws images with object-fit)
+    scale = min(1.0, max(display_width * dpr / native_width, display_height * dpr / native_height))
+    if scale * scale > MAX_RESAMPLED_AREA:
+        return native_width, native_height
+    # Degenerate (zero-sized) placements still get a 1 px image
+    width = max(1, min(native_width, math.ceil(native_width * scale / IMAGE_SIZE_STEP) * IMAGE_SIZE_STEP))
+    return width, max(1, round(native_height * width / native_width))
+
+
+def is_photographic(image):
+    # Few distinct colors means line art, text or flat graphics (PNG wins);
+    # the check runs on a ~128 px box-filtered copy, so it is cheap at any size
+    thumbnail = image.reduce(max(1, max(image.size) // 128))
+    return thumbnail.convert("RGB").getcolors(LINE_ART_MAX_COLORS) is None
+
+
+def encode_image(image, photographic, photo_format=PHOTO_FORMAT):
+    # -> (bytes, extension). JPEG has no alpha, so transparent photos stay PNG
+    # when the photo format is JPEG.
+    has_alpha = image.mode in ("LA", "RGBA", "PA")
+    out = io.BytesIO()
+    if photographic and photo_format == "webp":
+        image.convert("RGBA" if has_alpha else "RGB").save(out, "WEBP", quality=PHOTO_QUALITY, method=WEBP_METHOD)
+    elif photographic and photo_format == "jpeg" and not has_alpha:
+        image.convert("L" if image.mode == "L" else "RGB").save(
+            out, "JPEG", quality=PHOTO_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(out, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+        return out.getvalue(), "png"
+    return out.getvalue(), FORMAT_EXTENSIONS[photo_format]
+
+
+# ---------- IMAGE ASSET STORE ----------
+class ImageAssetStore:
+    # One store per open document: each xref is hashed once and each
+    # (xref, encoded size) is encoded at most once. Files are named by the
+    # hash of the raw PDF stream plus the size, so the same image embedded
+    # in another document at the same size reuses the existing asset.
+
+    def __init__(self, pdf_doc, asset_folder=ASSET_FOLDER, url_prefix=ASSET_URL_PREFIX, dpr=IMAGE_DPR):
+        self.pdf_doc = pdf_doc
+        self.asset_folder = asset_folder
+        self.url_prefix = url_prefix
+        self.dpr = dpr
+        self._urls = {}     # (xref, width, height) -> url
+        self._sources = {}  # xref -> (digest, native size, plain JPEG?)
+        os.makedirs(self.asset_folder, exist_ok=True)
+
+    def url_for(self, xref, display_width, display_height):
+        # display_width/height: CSS pixels the image is drawn at
+        digest, native, jpeg = self._source(xref)
+        size = target_size(*native, display_width, display_height, self.dpr)
+        url = self._urls.get((xref, *size))
+        if url is None:
+            url = self._urls[(xref, *size)] = self.url_prefix + self._store(xref, digest, native, jpeg, size)
+        return url
+
+    def _source(self, xref):
+        # (raw stream digest, native pixel size, whether the stream is a plain
+        # gray/RGB JPEG file). Read from the stream dictionary and the JPEG
+        # header only; nothing is decoded here.
+        source = self._sources.get(xref)
+        if source is None:
+            raw = self.pdf_doc.xref_stream_raw(xref)
+            digest = hashlib.sha256(raw).hexdigest()
+            native = self._native_size(xref)
+            jpeg = False
+            if self.pdf_doc.xref_get_key(xref, "Filter") == ("name", "/DCTDecode"):
+                from PIL import Image
+                try:
+                    with Image.open(io.BytesIO(raw)) as header:
+                        # CMYK JPEGs render inconsistently across browsers
+                        jpeg = header.format == "JPEG" and header.mode in ("L", "RGB")
+                except Exception:
+                    pass
+            source = self._sources[xref] = (digest, native, jpeg)
+        return source
+
+    def _dict_int(self, xref, key):
+        # /Width and /Height may be indirect objects ("11 0 R")
+        kind, value = self.pdf_doc.xref_get_key(xref, key)
+        if kind == "xref":
+            value = self.pdf_doc.xref_object(int(value.split()[0]))
+        return int(value.strip())
+
+    def _native_size(self, xref):
+        try:
+            return self._dict_int(xref, "Width"), self._dict_int(xref, "Height")
+        except (ValueError, IndexError):
+            # Unreadable dictionary: take the size from the decoded image
+            import fitz  # PyMuPDF
+            pix = fitz.Pixmap(self.pdf_doc, xref)
+            return pix.width, pix.height
+
+    def _existing(self, base_name):
+        for ext in FORMAT_EXTENSIONS.values():
+            name = f"{base_name}.{ext}"
+            if os.path.exists(os.path.join(self.asset_folder, name)):
+                return name
+        return None
+
+    def _store(self, xref, digest, native, jpeg, size):
+        # A JPEG that needs no downscaling is served untouched
+        if jpeg and size == native:
+            name = f"{digest}.{PASSTHROUGH_FORMATS['jpeg']}"
+            if not os.path.exists(os.path.join(self.asset_folder, name)):
+                write_bytes_atomic(os.path.join(self.asset_folder, name), self.pdf_doc.xref_stream_raw(xref))
+            return name
+
+        base_name = f"{digest}-{size[0]}x{size[1]}"
+        name = self._existing(base_name)
+        if name:
+            return name
+        image = self._decode(xref, jpeg, size)
+        if image.size != size:
+            from PIL import Image
+            image = image.resize(size, Image.BICUBIC, reducing_gap=3.0)
+        img_bytes, ext = encode_image(image, jpeg or is_photographic(image))
+        name = f"{base_name}.{ext}"
+        write_bytes_atomic(os.path.join(self.asset_folder, name), img_bytes)
+        return name
+
+    def _decode(self, xref, jpeg, size):
+        import fitz  # PyMuPDF
+        from PIL import Image
+        if jpeg:
+            # libjpeg decodes straight at a reduced scale (down to 1/8)
+            image = Image.open(io.BytesIO(self.pdf_doc.xref_stream_raw(xref)))
+            image.draft(image.mode, size)
+            return image
+        pix = fitz.Pixmap(self.pdf_doc, xref)
+        if pix.n - pix.alpha >= 4:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        return pix.pil_image()
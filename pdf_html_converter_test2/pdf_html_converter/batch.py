@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cache import hash_file
+from validation import open_validated_pdf
+from assets import ImageAssetStore
+from fonts import DocumentFonts, FontCache
+from writer import DocumentWriter, TARGET_WIDTH, write_text_atomic, relative_file_url
+from converter import convert_pages_serial, COMPACT_HTML
+from tables import TABLE_BACKEND, TABLE_BACKENDS
+
+BATCH_FOLDER = os.path.join("output", "batch")
+MANIFEST_NAME = "manifest.json"
+
+
+# ---------- INPUTS ----------
+def find_pdfs(inputs):
+    # Files are taken as given; directories are searched recursively
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(".pdf"))
+        else:
+            paths.append(item)
+    return paths
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"documents": {}}
+
+
+def is_done(record, out_dir):
+    return (record.get("status") == "completed"
+            and all(os.path.exists(os.path.join(out_dir, record[key])) for key in ("html", "json")))
+
+
+# ---------- WORKER ----------
+def convert_document(pdf_path, pdf_hash, out_dir, compact_json=False, write_compare=False, table_backend=None):
+    # Runs in a pool process. Output is named by the content hash so two
+    # files called report.pdf cannot collide. Fonts and images go to shared
+    # fonts/ and assets/ folders under out_dir with relative URLs, so the
+    # HTML works when opened straight from disk.
+    start = time.time()
+    base_name = f"{os.path.splitext(os.path.basename(pdf_path))[0]}-{pdf_hash[:12]}"
+    record = {
+        "source": pdf_path,
+        "html": base_name + ".html",
+        "json": base_name + ".json",
+        "compare": base_name + ".compare.html" if write_compare else None
+    }
+    pdf_doc = None
+    try:
+        # Same checks as web uploads: empty, oversized and scanned documents fail
+        pdf_doc, _, errors = open_validated_pdf(pdf_path)
+        if errors:
+            raise ValueError(" | ".join(errors))
+        record["pages"] = len(pdf_doc)
+        document_fonts = DocumentFonts(pdf_doc, cache=FontCache(os.path.join(out_dir, "fonts")), url_prefix="fonts/")
+        writer = DocumentWriter(os.path.join(out_dir, record["html"]),
+                                os.path.join(out_dir, record["compare"]) if write_compare else None,
+                                os.path.join(out_dir, record["json"]), relative_file_url(pdf_path, out_dir),
+                                TARGET_WIDTH, len(pdf_doc), None, None,
+                                compact_json=compact_json, compact_html=COMPACT_HTML)
+
+        def write_page(page):
+            document_fonts.add_chars(page.font_chars)
+            writer.write_page(page)
+        try:
+            convert_pages_serial(pdf_doc, pdf_path, document_fonts.name_map, TARGET_WIDTH, write_page,
+                                 image_store=ImageAssetStore(pdf_doc, os.path.join(out_dir, "assets"), "assets/"),
+                                 table_backend=table_backend)
+        except Exception:
+            writer.abort()
+            raise
+        conversion_time = round(time.time() - start, 2)
+        writer.close(conversion_time, document_fonts.css())
+        pdf_doc.close()
+        record.update(status="completed", seconds=conversion_time)
+    except Exception as e:
+        if pdf_doc is not None:
+            pdf_doc.close()
+        record.update(status="error", error=str(e), seconds=round(time.time() - start, 2))
+    return record
+
+
+# ---------- BATCH RUN ----------
+def run_batch(inputs, out_dir=BATCH_FOLDER, workers=None, compact_json=False, write_compare=False, force=False,
+              table_backend=None):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    documents = manifest["documents"]
+
+    # Documents are keyed by content hash: renamed or duplicate files are
+    # skipped too, and a re-run resumes after the last finished document
+    todo = {}
+    skipped = 0
+    for pdf_path in find_pdfs(inputs):
+        pdf_hash = hash_file(pdf_path)
+        if pdf_hash in todo or (not force and is_done(documents.get(pdf_hash, {}), out_dir)):
+            skipped += 1
+            continue
+        todo[pdf_hash] = pdf_path
+
+    start = time.time()
+    completed = failed = pages = 0
+    print(f"{len(todo)} to convert, {skipped} already done")
+    pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {
+            pool.submit(convert_document, pdf_path, pdf_hash, out_dir, compact_json, write_compare,
+                        table_backend): pdf_hash
+            for pdf_hash, pdf_path in todo.items()
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            documents[futures[future]] = record
+            # Saved after every document so an interrupted run loses nothing
+            write_text_atomic(manifest_path, json.dumps(manifest, indent=4))
+            if record["status"] == "completed":
+                completed += 1
+                pages += record["pages"]
+                print(f"[{completed + failed}/{len(todo)}] {record['source']}: {record['pages']} pages "
+                      f"in {record['seconds']}s")
+            else:
+                failed += 1
+                print(f"[{completed + failed}/{len(todo)}] {record['source']}: FAILED {record['error']}")
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted; re-run to continue where this run stopped")
+        raise
+    pool.shutdown()
+
+    elapsed = time.time() - start
+    minutes = elapsed / 60 or 1e-9
+    return {
+        "converted": completed,
+        "failed": failed,
+        "skipped": skipped,
+        "pages": pages,
+        "seconds": round(elapsed, 2),
+        "documents_per_minute": round(completed / minutes, 2),
+        "pages_per_minute": round(pages / minutes, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a directory or list of PDFs to HTML/JSON")
+    parser.add_argument("inputs", nargs="+", help="PDF files and/or directories (searched recursively)")
+    parser.add_argument("--out", default=BATCH_FOLDER, help=f"output directory (default {BATCH_FOLDER})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="conversion processes")
+    parser.add_argument("--compact-json", action="store_true", help="write JSON without indentation")
+    parser.add_argument("--compare", action="store_true", help="also write the side-by-side comparison pages")
+    parser.add_argument("--table-backend", choices=sorted(TABLE_BACKENDS), default=TABLE_BACKEND,
+                        help=f"table detection backend (default {TABLE_BACKEND})")
+    parser.add_argument("--force", action="store_true", help="convert documents the manifest marks as done")
+    args = parser.parse_args()
+
+    report = run_batch(args.inputs, args.out, args.workers, args.compact_json, args.compare, args.force,
+                       args.table_backend)
+    print(f"Converted {report['converted']}, failed {report['failed']}, skipped {report['skipped']} "
+          f"in {report['seconds']}s: {report['documents_per_minute']} documents/min, "
+          f"{report['pages_per_minute']} pages/min")
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import resource
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import fitz  # PyMuPDF
+import converter
+from assets import ImageAssetStore
+from tables import TABLE_BACKEND, TABLE_BACKENDS, TableIndex, open_table_detector, table_rows
+from spans import PageSpans, text_elements
+from fonts import DocumentFonts, FontCache
+from writer import DocumentWriter, TARGET_WIDTH, relative_file_url
+from converter import convert_page, convert_pages_serial, convert_pages_parallel, html_to_json
+
+CORPUS = sorted(glob.glob(os.path.join("uploads", "*.pdf"))) + [os.path.join("static", "pdfs", "original.pdf")]
+
+# Report stage names, in pipeline order; convert_page's on_stage names map
+# onto the middle three
+STAGES = ("fonts", "table_detection", "span_extraction", "image_encoding", "html_assembly", "html_to_json")
+PAGE_STAGES = {"tables": "table_detection", "text": "span_extraction", "images": "image_encoding"}
+# A stage regresses when it is this much slower (or bigger) than the baseline
+# and the absolute difference is above the noise floor
+DEFAULT_THRESHOLD = 0.15
+MIN_WALL_DELTA_S = 0.02
+MIN_BYTES_DELTA = 1024
+# Span microbenchmark: the most text-dense pages of each file, best of N runs
+SPAN_BENCH_PAGES = 5
+SPAN_BENCH_REPEAT = 20
+# Table backend comparison: tables overlapping by at least this IoU are the
+# same table
+TABLE_MATCH_IOU = 0.9
+# Startup benchmark: fresh processes importing the app and converting
+# STARTUP_PDF, best of STARTUP_REPEAT; "steady" converts STARTUP_WARMUP_PDF
+# first, as a process that has already served a job would have
+STARTUP_PDF = os.path.join("uploads", "sample-tables.pdf")
+STARTUP_WARMUP_PDF = os.path.join("uploads", "sample.pdf")
+STARTUP_REPEAT = 3
+STARTUP_SCENARIOS = {
+    "cold": {"PREWARM_CONVERSION": "0"},
+    "prewarmed": {"PREWARM_CONVERSION": "1"},
+    "steady": {"PREWARM_CONVERSION": "0"}
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def folder_bytes(folder):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(folder) for name in names
+    )
+
+
+# ---------- STAGE CLOCK ----------
+class StageClock:
+    # Attributes wall and CPU time to whichever stage is current; switch()
+    # closes the running stage. ru_maxrss only ever grows, so each stage
+    # records how far it raised the process high-water mark (0 when it stayed
+    # under an earlier peak); --tracemalloc adds the Python heap peak reached
+    # within the stage itself.
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {stage: {"wall_s": 0.0, "cpu_s": 0.0, "rss_growth_mb": 0.0, "bytes": 0} for stage in STAGES}
+        if trace_memory:
+            for stats in self.stages.values():
+                stats["peak_heap_mb"] = 0.0
+        self._current = None
+
+    def switch(self, stage):
+        now, cpu = time.perf_counter(), time.process_time()
+        if self._current:
+            stats = self.stages[self._current]
+            stats["wall_s"] += now - self._start
+            stats["cpu_s"] += cpu - self._cpu_start
+            rss = peak_rss_mb()
+            stats["rss_growth_mb"] = round(stats["rss_growth_mb"] + rss - self._rss_start, 1)
+            if self.trace_memory:
+                heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                stats["peak_heap_mb"] = round(max(stats["peak_heap_mb"], heap_peak), 2)
+        self._current = stage
+        if stage and self.trace_memory:
+            tracemalloc.reset_peak()
+        self._rss_start = peak_rss_mb()
+        self._start, self._cpu_start = time.perf_counter(), time.process_time()
+
+    def stop(self):
+        self.switch(None)
+
+
+# ---------- PER-STAGE BENCHMARK ----------
+def profile_file(filename, work_dir, trace_memory=False, table_backend=None):
+    # One cold conversion: fonts and images go to empty folders under work_dir
+    # so earlier runs cannot turn the stages into cache hits
+    clock = StageClock(trace_memory)
+    counts = {"pages": 0, "spans": 0, "images": 0, "tables": 0}
+    font_folder = os.path.join(work_dir, "fonts")
+    asset_folder = os.path.join(work_dir, "assets")
+
+    clock.switch("fonts")
+    pdf_doc = fitz.open(filename)
+    document_fonts = DocumentFonts(pdf_doc, cache=FontCache(font_folder))
+    page_heights = [int(page.rect.height * TARGET_WIDTH / page.rect.width) for page in pdf_doc]
+
+    clock.switch("html_assembly")
+    html_path = os.path.join(work_dir, "document.html")
+    json_path = os.path.join(work_dir, "document.json")
+    compare_path = os.path.join(work_dir, "compare.html")
+    writer = DocumentWriter(html_path, compare_path, json_path, relative_file_url(filename, work_dir),
+                            TARGET_WIDTH, len(pdf_doc), os.path.join(work_dir, "pages"), page_heights,
+                            compact_html=converter.COMPACT_HTML)
+
+    table_detector = open_table_detector(filename, table_backend)
+    image_store = ImageAssetStore(pdf_doc, asset_folder=asset_folder)
+    on_stage = lambda stage: clock.switch(PAGE_STAGES[stage])
+    try:
+        for page_num in range(len(pdf_doc)):
+            clock.switch("table_detection")
+            page = convert_page(pdf_doc[page_num], table_detector, document_fonts.name_map, TARGET_WIDTH,
+                                image_store, on_stage)
+            clock.switch("html_assembly")
+            document_fonts.add_chars(page.font_chars)
+            writer.write_page(page)
+            counts["pages"] += 1
+            for element in page.elements:
+                kind = type(element).__name__
+                if kind == "TextElement":
+                    counts["spans"] += 1
+                elif kind == "ImageElement":
+                    counts["images"] += 1
+                else:
+                    counts["tables"] += 1
+    finally:
+        table_detector.close()
+
+    clock.switch("fonts")
+    font_css = document_fonts.css()
+    clock.switch("html_assembly")
+    writer.close(0, font_css)
+    pdf_doc.close()
+
+    clock.switch("html_to_json")
+    with open(html_path, encoding="utf-8") as f:
+        html_to_json(f.read(), os.path.join(work_dir, "html_to_json.json"))
+    clock.stop()
+
+    stages = clock.stages
+    stages["fonts"]["bytes"] = len(font_css.encode("utf-8")) + folder_bytes(font_folder)
+    stages["image_encoding"]["bytes"] = folder_bytes(asset_folder)
+    stages["html_assembly"]["bytes"] = sum(os.path.getsize(path) for path in (html_path, json_path, compare_path))
+    stages["html_to_json"]["bytes"] = os.path.getsize(os.path.join(work_dir, "html_to_json.json"))
+    return {"counts": counts, "stages": stages}
+
+
+def run_suite(files, repeat=1, trace_memory=False, table_backend=None):
+    # Per stage, the fastest of `repeat` cold runs is kept
+    results = {}
+    if trace_memory:
+        tracemalloc.start()
+    for filename in files:
+        best = None
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix="pdfbench-")
+            try:
+                run = profile_file(filename, work_dir, trace_memory, table_backend)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            if best is None:
+                best = run
+                continue
+            for stage, stats in run["stages"].items():
+                kept = best["stages"][stage]
+                kept["wall_s"] = min(kept["wall_s"], stats["wall_s"])
+                kept["cpu_s"] = min(kept["cpu_s"], stats["cpu_s"])
+        for stats in best["stages"].values():
+            stats["wall_s"] = round(stats["wall_s"], 4)
+            stats["cpu_s"] = round(stats["cpu_s"], 4)
+        best["total_wall_s"] = round(sum(stats["wall_s"] for stats in best["stages"].values()), 4)
+        results[os.path.basename(filename)] = best
+        print_file_row(os.path.basename(filename), best)
+    if trace_memory:
+        tracemalloc.stop()
+    return results
+
+
+def print_file_row(name, result):
+    stages = result["stages"]
+    print(f"{name[:40]:<40} {result['counts']['pages']:>5} "
+          + " ".join(f"{stages[stage]['wall_s']:>9.3f}" for stage in STAGES)
+          + f" {result['total_wall_s']:>8.3f}s")
+
+
+def print_header():
+    labels = ("fonts", "tables", "spans", "images", "assembly", "to_json")
+    print(f"{'file':<40} {'pages':>5} " + " ".join(f"{label:>9}" for label in labels) + f" {'total':>9}")
+
+
+# ---------- BASELINE COMPARISON ----------
+def compare_reports(report, baseline, threshold):
+    # Returns the list of regressions (file, stage, metric, old, new)
+    regressions = []
+    for scenario, result in report.get("startup", {}).items():
+        old = baseline.get("startup", {}).get(scenario)
+        if old is None:
+            continue
+        for metric in ("import_s", "first_conversion_s"):
+            if (result[metric] > old[metric] * (1 + threshold)
+                    and result[metric] - old[metric] > MIN_WALL_DELTA_S):
+                regressions.append(("startup", scenario, metric, old[metric], result[metric]))
+    for name, result in report.get("files", {}).items():
+        base = baseline.get("files", {}).get(name)
+        if base is None:
+            continue
+        for stage, stats in result["stages"].items():
+            old = base["stages"].get(stage)
+            if old is None:
+                continue
+            if (stats["wall_s"] > old["wall_s"] * (1 + threshold)
+                    and stats["wall_s"] - old["wall_s"] > MIN_WALL_DELTA_S):
+                regressions.append((name, stage, "wall_s", old["wall_s"], stats["wall_s"]))
+            if (stats["bytes"] > old["bytes"] * (1 + threshold)
+                    and stats["bytes"] - old["bytes"] > MIN_BYTES_DELTA):
+                regressions.append((name, stage, "bytes", old["bytes"], stats["bytes"]))
+    return regressions
+
+
+# ---------- SERIAL VS PARALLEL ----------
+def time_page_loops(filename):
+    pdf_doc = fitz.open(filename)
+    total_pages = len(pdf_doc)
+    font_name_map = DocumentFonts(pdf_doc).name_map
+
+    serial_pages = []
+    start = time.perf_counter()
+    convert_pages_serial(pdf_doc, filename, font_name_map, TARGET_WIDTH,
+                         lambda page: serial_pages.append(page.to_html()))
+    serial_time = time.perf_counter() - start
+    pdf_doc.close()
+
+    parallel_pages = []
+    start = time.perf_counter()
+    convert_pages_parallel(filename, list(range(total_pages)), font_name_map, TARGET_WIDTH,
+                           lambda page: parallel_pages.append(page.to_html()))
+    parallel_time = time.perf_counter() - start
+
+    return {
+        "pages": total_pages,
+        "serial_s": serial_time,
+        "parallel_s": parallel_time,
+        "identical": serial_pages == parallel_pages
+    }
+
+
+def run_parallel_comparison(files, workers):
+    converter.CONVERSION_WORKERS = workers
+    # Start the pool up front so worker spawn time is not billed to the first PDF
+    converter.get_page_pool().submit(int).result()
+
+    print(f"{'file':<45} {'pages':>5} {'serial':>8} {'parallel':>9} {'speedup':>8}  same")
+    total_serial = total_parallel = 0
+    for filename in files:
+        row = time_page_loops(filename)
+        total_serial += row["serial_s"]
+        total_parallel += row["parallel_s"]
+        print(f"{os.path.basename(filename)[:45]:<45} {row['pages']:>5} {row['serial_s']:>7.2f}s "
+              f"{row['parallel_s']:>8.2f}s {row['serial_s'] / row['parallel_s']:>7.2f}x  {row['identical']}")
+    print(f"{'TOTAL':<45} {'':>5} {total_serial:>7.2f}s {total_parallel:>8.2f}s "
+          f"{total_serial / total_parallel:>7.2f}x")
+
+
+# ---------- SPAN EXTRACTION MICROBENCHMARK ----------
+def time_span_extraction(filename, top_pages=SPAN_BENCH_PAGES, repeat=SPAN_BENCH_REPEAT):
+    # The text stage alone (get_text through TextElements), without tables,
+    # on the file's densest pages
+    pdf_doc = fitz.open(filename)
+    font_name_map = DocumentFonts(pdf_doc).name_map
+    densest = sorted(((len(PageSpans(page)), page.number) for page in pdf_doc), reverse=True)[:top_pages]
+    spans = seconds = 0
+    for span_count, page_num in densest:
+        page = pdf_doc[page_num]
+        scale = TARGET_WIDTH / page.rect.width
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            text_elements(page, TableIndex([]), font_name_map, scale, {}, converter.COMPACT_HTML, converter.MERGE_GAP)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        spans += span_count
+        seconds += best
+    pdf_doc.close()
+    return {"pages": len(densest), "spans": spans, "seconds": seconds}
+
+
+def run_span_benchmark(files):
+    print(f"{'file':<45} {'pages':>5} {'spans':>7} {'ms/page':>8} {'us/span':>8}")
+    total_spans = total_seconds = 0
+    for filename in files:
+        row = time_span_extraction(filename)
+        total_spans += row["spans"]
+        total_seconds += row["seconds"]
+        if row["spans"]:
+            print(f"{os.path.basename(filename)[:45]:<45} {row['pages']:>5} {row['spans']:>7} "
+                  f"{row['seconds'] * 1000 / row['pages']:>8.2f} {row['seconds'] * 1e6 / row['spans']:>8.2f}")
+    print(f"{'TOTAL':<45} {'':>5} {total_spans:>7} {'':>8} {total_seconds * 1e6 / (total_spans or 1):>8.2f}")
+
+
+# ---------- TABLE BACKEND COMPARISON ----------
+def detect_tables(filename, backend):
+    # {page number: [(bbox, rows)]} through one backend, and the seconds spent
+    # on detection and extraction (pre-screen included)
+    pdf_doc = fitz.open(filename)
+    table_detector = open_table_detector(filename, backend)
+    tables = {}
+    start = time.perf_counter()
+    try:
+        for page in pdf_doc:
+            found = [(table.bbox, table_rows(table.extract() or []))
+                     for table in table_detector.find_tables(page) if table.cells]
+            if found:
+                tables[page.number] = found
+    finally:
+        table_detector.close()
+    seconds = time.perf_counter() - start
+    pdf_doc.close()
+    return tables, seconds
+
+
+def bbox_iou(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    overlap = width * height
+    return overlap / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - overlap)
+
+
+def normalized_rows(rows):
+    # Cell text with whitespace runs collapsed; line breaks inside a cell
+    # differ between the backends without changing what is shown
+    return [[(" ".join(text.split()), rowspan, colspan) for text, rowspan, colspan in row] for row in rows]
+
+
+def table_agreement(tables, reference):
+    # (tables matched by position, of those the ones with the same grid and text)
+    matched = same = 0
+    for page_num, page_tables in tables.items():
+        candidates = list(reference.get(page_num, []))
+        for bbox, rows in page_tables:
+            best = max(candidates, key=lambda other: bbox_iou(bbox, other[0]), default=None)
+            if best is None or bbox_iou(bbox, best[0]) < TABLE_MATCH_IOU:
+                continue
+            candidates.remove(best)
+            matched += 1
+            same += normalized_rows(rows) == normalized_rows(best[1])
+    return matched, same
+
+
+def run_table_comparison(files, backends=tuple(TABLE_BACKENDS)):
+    # Speed of every backend, and how far each agrees with the first one
+    reference_name = backends[0]
+    print(f"{'file':<40} {'pages':>5} " + " ".join(f"{name:>11}" for name in backends)
+          + " " + " ".join(f"{name + ' tables':>17}" for name in backends) + "  matched  same")
+    totals = {name: 0.0 for name in backends}
+    for filename in files:
+        results = {name: detect_tables(filename, name) for name in backends}
+        reference = results[reference_name][0]
+        with fitz.open(filename) as pdf_doc:
+            pages = len(pdf_doc)
+        agreement = []
+        for name in backends[1:]:
+            matched, same = table_agreement(results[name][0], reference)
+            agreement.append(f"{matched:>8} {same:>5}")
+        for name in backends:
+            totals[name] += results[name][1]
+        print(f"{os.path.basename(filename)[:40]:<40} {pages:>5} "
+              + " ".join(f"{results[name][1]:>10.3f}s" for name in backends) + " "
+              + " ".join(f"{sum(len(found) for found in results[name][0].values()):>17}" for name in backends)
+              + " " + " ".join(agreement))
+    print(f"{'TOTAL':<40} {'':>5} " + " ".join(f"{totals[name]:>10.3f}s" for name in backends))
+
+
+# ---------- STARTUP ----------
+# Runs in a fresh interpreter with the work directory as cwd:
+# argv = app source dir, PDF to time, PDFs to convert before it
+STARTUP_SCRIPT = """
+import sys, json, time, threading
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+imported = time.perf_counter()
+for thread in threading.enumerate():
+    if thread.name == "prewarm":
+        thread.join()
+warmed = time.perf_counter()
+for number, warmup in enumerate(sys.argv[3:]):
+    app.convert_pdf_with_progress(warmup, f"warmup-{number}")
+job_start = time.perf_counter()
+app.convert_pdf_with_progress(sys.argv[2], "first")
+print(json.dumps({
+    "import_s": imported - start,
+    "prewarm_wait_s": warmed - imported,
+    "first_conversion_s": time.perf_counter() - job_start,
+    "status": app.job_store.get("first")["status"]
+}))
+"""
+
+
+def time_startup(scenario, pdf=STARTUP_PDF, warmup_pdf=STARTUP_WARMUP_PDF):
+    # One fresh process in an empty work dir, so no cache is warm
+    work_dir = tempfile.mkdtemp(prefix="pdfbench-startup-")
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    args = [sys.executable, "-c", STARTUP_SCRIPT, source_dir, os.path.abspath(pdf)]
+    if scenario == "steady":
+        args.append(os.path.abspath(warmup_pdf))
+    try:
+        start = time.perf_counter()
+        output = subprocess.run(args, cwd=work_dir, env=dict(os.environ, **STARTUP_SCENARIOS[scenario]),
+                                capture_output=True, text=True, check=True).stdout
+        process_s = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_s"] = process_s
+    return result
+
+
+def run_startup_benchmark(repeat=STARTUP_REPEAT):
+    # Import time and time to the first finished conversion, per scenario
+    print(f"{'scenario':<12} {'import':>8} {'prewarm':>8} {'first job':>10} {'process':>8}")
+    results = {}
+    for scenario in STARTUP_SCENARIOS:
+        runs = [time_startup(scenario) for _ in range(repeat)]
+        if any(run["status"] != "completed" for run in runs):
+            raise RuntimeError(f"Startup conversion failed in the {scenario} scenario")
+        best = {metric: round(min(run[metric] for run in runs), 4)
+                for metric in ("import_s", "prewarm_wait_s", "first_conversion_s", "process_s")}
+        results[scenario] = best
+        print(f"{scenario:<12} {best['import_s']:>7.3f}s {best['prewarm_wait_s']:>7.3f}s "
+              f"{best['first_conversion_s']:>9.3f}s {best['process_s']:>7.3f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the converter per stage over a fixed PDF corpus")
+    parser.add_argument("files", nargs="*", help="PDFs to convert (default: uploads/ corpus)")
+    parser.add_argument("--report", help="write the machine-readable JSON report here")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against an earlier report")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown/growth counted as a regression (default 0.15)")
+    parser.add_argument("--repeat", type=int, default=1, help="cold runs per file; the fastest is kept")
+    parser.add_argument("--tracemalloc", action="store_true", help="also record the Python heap peak per stage")
+    parser.add_argument("--parallel", action="store_true", help="compare serial vs page-parallel conversion instead")
+    parser.add_argument("--workers", type=int, default=converter.CONVERSION_WORKERS)
+    parser.add_argument("--spans", action="store_true",
+                        help="time span extraction alone on each file's most text-dense pages instead")
+    parser.add_argument("--tables", action="store_true",
+                        help="compare table detection backends for speed and agreement instead")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure app import and time-to-first-conversion in fresh processes instead")
+    parser.add_argument("--table-backend", choices=sorted(TABLE_BACKENDS), default=TABLE_BACKEND,
+                        help=f"table detection backend for the stage benchmark (default {TABLE_BACKEND})")
+    args = parser.parse_args()
+    files = args.files or CORPUS
+
+    if args.parallel:
+        run_parallel_comparison(files, args.workers)
+        return
+    if args.spans:
+        run_span_benchmark(files)
+        return
+    if args.tables:
+        run_table_comparison(files)
+        return
+
+    report = {
+        "created_at": time.time(),
+        "machine": {
+            "python": platform.python_version(),
+            "pymupdf": fitz.VersionBind,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        }
+    }
+    if args.startup:
+        # Tracked like the stages: --report writes it, --compare flags regressions
+        report["settings"] = {"pdf": STARTUP_PDF, "repeat": STARTUP_REPEAT, "workers": converter.CONVERSION_WORKERS}
+        report["startup"] = run_startup_benchmark()
+    else:
+        print_header()
+        report["settings"] = {
+            "target_width": TARGET_WIDTH,
+            "repeat": args.repeat,
+            "compact_html": converter.COMPACT_HTML,
+            "table_backend": args.table_backend
+        }
+        report["files"] = run_suite(files, args.repeat, args.tracemalloc, args.table_backend)
+        report["total_wall_s"] = round(sum(result["total_wall_s"] for result in report["files"].values()), 4)
+        print(f"{'TOTAL':<40} {'':>5} " + " " * 10 * len(STAGES) + f"{report['total_wall_s']:>8.3f}s")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.threshold)
+        for name, stage, metric, old, new in regressions:
+            print(f"REGRESSION {name} {stage} {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+# Bump whenever the converter output changes so stale entries are never served
+CONVERTER_VERSION = "8"
+CACHE_FOLDER = os.path.join("output", "cache")
+MAX_CACHE_SIZE_MB = 500
+
+logger = logging.getLogger(__name__)
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(pdf_hash, **settings):
+    # Key covers the document bytes, the converter version and every setting
+    # that changes the output (e.g. target_width)
+    payload = json.dumps({
+        "pdf": pdf_hash,
+        "version": CONVERTER_VERSION,
+        "settings": settings
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ---------- CONVERSION CACHE ----------
+class ConversionCache:
+    # Each entry is a directory <cache_folder>/<key>/ holding the stored
+    # artifacts. The directory mtime is the LRU timestamp, so recency survives
+    # restarts without a separate index file.
+
+    def __init__(self, cache_folder=CACHE_FOLDER, max_size_mb=MAX_CACHE_SIZE_MB):
+        self.cache_folder = cache_folder
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        for key in os.listdir(self.cache_folder):
+            entry_dir = os.path.join(self.cache_folder, key)
+            if not os.path.isdir(entry_dir):
+                continue
+            if key.endswith(".tmp"):
+                # Leftover from an interrupted put()
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            self._adopt(key)
+
+    def _adopt(self, key):
+        # Index an entry directory found on disk, e.g. one written by another
+        # process sharing the cache folder after this one started
+        entry_dir = self._entry_dir(key)
+        size = sum(
+            os.path.getsize(os.path.join(entry_dir, name))
+            for name in os.listdir(entry_dir)
+        )
+        entry = self._entries[key] = {"size": size, "last_used": os.path.getmtime(entry_dir)}
+        return entry
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_folder, key)
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def get(self, key, count=True):
+        # Returns {artifact name: path} for a hit, None for a miss. The disk,
+        # not the in-memory index, decides: other processes write entries too.
+        # count=False leaves hits/misses alone, for re-checking a key whose
+        # lookup was already counted.
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            try:
+                entry = self._entries.get(key) or self._adopt(key)
+                now = time.time()
+                os.utime(entry_dir, (now, now))
+                artifacts = {name: os.path.join(entry_dir, name) for name in os.listdir(entry_dir)}
+            except OSError:
+                # Missing, or evicted by another process
+                self._entries.pop(key, None)
+                self.misses += count
+                return None
+            entry["last_used"] = now
+            self.hits += count
+            return artifacts
+
+    def put(self, key, artifacts):
+        # artifacts: {artifact name: path of the file to store}. Caching is
+        # best effort: a failure here is logged and never fails the job.
+        with self._lock:
+            try:
+                self._put(key, artifacts)
+            except OSError as e:
+                logger.warning("Could not cache conversion %s: %s", key, e)
+
+    def _put(self, key, artifacts):
+        entry_dir = self._entry_dir(key)
+        if key in self._entries or os.path.isdir(entry_dir):
+            # Already cached, possibly by another process
+            if key not in self._entries:
+                self._adopt(key)
+            return
+        # Unique per writer, so two processes storing the same key never
+        # share a staging directory
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_folder, prefix=f"{key}.", suffix=".tmp")
+        try:
+            size = 0
+            for name, source_path in artifacts.items():
+                path = os.path.join(tmp_dir, name)
+                shutil.copyfile(source_path, path)
+                size += os.path.getsize(path)
+            if size > self.max_bytes:
+                return
+            try:
+                os.replace(tmp_dir, entry_dir)
+            except OSError:
+                # Another process published the same entry first
+                if not os.path.isdir(entry_dir):
+                    raise
+                self._adopt(key)
+                return
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._entries[key] = {"size": size, "last_used": time.time()}
+        self._evict()
+
+    def _evict(self):
+        total = self.total_bytes()
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._entries.pop(key)["size"]
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self.total_bytes(),
+                "max_size_bytes": self.max_bytes
+            }
@@ -0,0 +1,76 @@
+import os
+import gzip
+import logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 9))
+# 11 is smallest but several times slower than 9 on multi-MB documents
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 9))
+# Files smaller than this are not worth a variant (or the extra requests' stat)
+MIN_COMPRESS_BYTES = 512
+CHUNK_SIZE = 1024 * 1024
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"} if brotli else {"gzip": ".gz"}
+
+
+# ---------- PRECOMPRESSED VARIANTS ----------
+# Finished artifacts are compressed once, next to the original
+# (document.html -> document.html.gz / document.html.br), and served as
+# static bytes. Whoever rewrites an artifact calls precompress() again.
+def variant_paths(path):
+    return [path + suffix for suffix in ENCODINGS.values()]
+
+
+def _gzip_file(path, out_path):
+    with open(path, "rb") as src, open(out_path, "wb") as raw:
+        # mtime=0 keeps the bytes identical for identical input
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as out:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                out.write(chunk)
+
+
+def _brotli_file(path, out_path):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    with open(path, "rb") as src, open(out_path, "wb") as out:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            out.write(compressor.process(chunk))
+        out.write(compressor.finish())
+
+
+def precompress(path):
+    # Write every encoding of `path` (atomically, readers may be serving the
+    # old one) and return the variant paths; small files get none
+    small = os.path.getsize(path) < MIN_COMPRESS_BYTES
+    for encoding, suffix in ENCODINGS.items():
+        variant = path + suffix
+        if small:
+            # Drop a variant left from a larger version of the file
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        tmp_path = variant + ".tmp"
+        try:
+            (_brotli_file if encoding == "br" else _gzip_file)(path, tmp_path)
+            os.replace(tmp_path, variant)
+        except Exception as e:
+            # A stale variant must never be served; the identity file still is
+            logger.warning("Could not %s-compress %s: %s", encoding, path, e)
+            for leftover in (tmp_path, variant):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+    return [variant for variant in variant_paths(path) if os.path.exists(variant)]
+
+
+def pick_variant(path, accept_encodings):
+    # (path to send, Content-Encoding or None) for a werkzeug Accept-Encoding
+    for encoding, suffix in ENCODINGS.items():
+        if accept_encodings[encoding] and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
@@ -0,0 +1,335 @@
+import fitz  # PyMuPDF
+import os
+import json
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from assets import ImageAssetStore
+from tables import TableIndex, open_table_detector, table_rows
+from metrics import StageTimer
+from model import Page, ImageElement, TableElement
+from spans import text_elements
+
+logger = logging.getLogger(__name__)
+
+# Page-parallel conversion: 0/1 workers keeps everything on the calling thread
+CONVERSION_WORKERS = int(os.environ.get("CONVERSION_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_PAGES = 8
+MAX_PAGES_PER_TASK = 4
+# Page chunks a parallel job keeps running or buffered, per worker
+TASKS_IN_FLIGHT_PER_WORKER = 2
+# A chunk whose worker died (e.g. a MuPDF crash) is retried this many times
+# on a fresh pool before the job fails
+MAX_CHUNK_RETRIES = 1
+# Large-document mode: from this many pages on, MuPDF's store is trimmed
+# every STORE_SHRINK_INTERVAL pages
+LARGE_DOCUMENT_PAGES = 200
+STORE_SHRINK_INTERVAL = 25
+# Compact HTML: merge same-style spans on a line and use shared style classes
+COMPACT_HTML = os.environ.get("COMPACT_HTML") == "1"
+# Largest gap (in units of font size) between spans that still get merged
+MERGE_GAP = 0.1
+
+# ---------- HTML → JSON HELPER ----------
+def page_div_to_json(page_div, page_idx):
+    page_obj = {
+        "page_number": page_idx,
+        "elements": []
+    }
+
+    # Extract positioned text
+    for text_div in page_div.select(".positioned-text"):
+        style = text_div.get("style", "")
+        page_obj["elements"].append({
+            "type": "text",
+            "text": text_div.get_text(),
+            "style": style
+        })
+
+    # Extract positioned images
+    for img_div in page_div.select(".positioned-image"):
+        img_tag = img_div.find("img")
+        if img_tag:
+            style = img_div.get("style", "")
+            src = img_tag.get("src", "")
+            page_obj["elements"].append({
+                "type": "image",
+                "style": style,
+                "src": src
+            })
+
+    # Extract tables
+    for table in page_div.find_all("table"):
+        rows = []
+        for tr in table.find_all("tr"):
+            row_data = []
+            for td in tr.find_all("td"):
+                cell_data = {
+                    "text": td.get_text(strip=True),
+                    "rowspan": td.get("rowspan"),
+                    "colspan": td.get("colspan")
+                }
+                row_data.append(cell_data)
+            rows.append(row_data)
+        page_obj["elements"].append({
+            "type": "table",
+            "rows": rows
+        })
+
+    return page_obj
+
+
+def html_to_json(html_content, json_path):
+    # bs4 is only needed here, so it is loaded on the first call
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_content, "html.parser")
+    pages_data = [
+        page_div_to_json(page_div, page_idx)
+        for page_idx, page_div in enumerate(soup.select(".page-container"), start=1)
+    ]
+
+    json_data = {
+        "document": {
+            "pages": pages_data
+        }
+    }
+
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(json_data, f, indent=4, ensure_ascii=False)
+
+    return json_data
+
+# ---------- PAGE CONVERSION ----------
+def convert_page(page_mupdf, table_detector, font_name_map, target_width, image_store, on_stage=None):
+    # on_stage(stage) is called as the page moves through tables/text/images;
+    # the time spent in each stage is returned on the Page
+    timer = StageTimer(on_stage)
+    timer.enter("tables")
+
+    page_width = page_mupdf.rect.width
+    page_height = page_mupdf.rect.height
+    scale = target_width / page_width
+    elements = []
+    font_chars = {}  # span font name -> characters used, for font subsetting
+
+    # Detect tables once; the same result drives span masking and table output
+    tables = table_detector.find_tables(page_mupdf)
+    table_index = TableIndex(table.bbox for table in tables)
+
+    # Text: one columnar pass over the page's spans, see spans.py
+    timer.enter("text")
+    elements.extend(text_elements(page_mupdf, table_index, font_name_map, scale, font_chars,
+                                  COMPACT_HTML, MERGE_GAP))
+
+    # Images: external assets resampled to the size they are drawn at,
+    # written once per xref and size, referenced by URL
+    timer.enter("images")
+    for img_index, img in enumerate(page_mupdf.get_images(full=True)):
+        xref = img[0]
+        rects = page_mupdf.get_image_rects(xref)
+        for rect in rects:
+            left = round(rect.x0 * scale, 1)
+            top = round(rect.y0 * scale, 1)
+            width = round((rect.x1 - rect.x0) * scale, 1)
+            height = round((rect.y1 - rect.y0) * scale, 1)
+            img_url = image_store.url_for(xref, width, height)
+            elements.append(ImageElement(
+                f"top: {top}px; left: {left}px; width: {width}px; height: {height}px;", img_url
+            ))
+
+
+    # Process tables (the detection backend extracts the cell text here)
+    timer.enter("tables")
+    for table in tables:
+        if not table.cells:
+            continue
+        x0, top, x1, bottom = table.bbox
+        width = (x1 - x0) * scale
+        height = (bottom - top) * scale
+        top_scaled = top * scale
+        left_scaled = x0 * scale
+
+        table_data = table.extract()
+        if not table_data:
+            continue
+        elements.append(TableElement(top_scaled, left_scaled, width, height, table_rows(table_data)))
+
+    return Page(page_mupdf.number + 1, int(page_height * scale), elements, font_chars, timer.stop())
+
+
+# ---------- SERIAL / PARALLEL PAGE LOOPS ----------
+# Both loops hand each converted Page to emit() in page order as soon as it is
+# ready, so callers can stream output instead of joining one big string.
+# They return how many pages the table pre-screen kept away from the table
+# backend; table_backend picks it (None: tables.TABLE_BACKEND).
+def convert_pages_serial(pdf_doc, filename, font_name_map, target_width, emit, on_page=None, on_stage=None,
+                         image_store=None, page_numbers=None, table_backend=None):
+    # page_numbers: 0-based pages to convert, in order (default: all)
+    if page_numbers is None:
+        page_numbers = range(len(pdf_doc))
+    total = len(page_numbers)
+    table_detector = open_table_detector(filename, table_backend)
+    image_store = image_store or ImageAssetStore(pdf_doc)
+    try:
+        for done, page_num in enumerate(page_numbers, start=1):
+            page_stage = (lambda stage, page=page_num + 1: on_stage(stage, page)) if on_stage else None
+            emit(convert_page(pdf_doc[page_num], table_detector, font_name_map, target_width, image_store,
+                              page_stage))
+            if on_page:
+                on_page(done, total)
+            if total >= LARGE_DOCUMENT_PAGES and done % STORE_SHRINK_INTERVAL == 0:
+                # Large-document mode: keep MuPDF's object store from growing
+                # with every page visited
+                fitz.TOOLS.store_shrink(100)
+        log_table_prescreen(table_detector.pages_skipped, total)
+        return table_detector.pages_skipped
+    finally:
+        table_detector.close()
+
+
+def log_table_prescreen(pages_skipped, total_pages):
+    logger.info("Table pre-screen skipped table detection on %d of %d pages", pages_skipped, total_pages)
+
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def get_page_pool():
+    # One long-lived pool per process; "spawn" so workers never inherit
+    # MuPDF state (or Flask threads) from a forked parent
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(
+                max_workers=CONVERSION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _page_pool
+
+
+def replace_broken_pool(pool):
+    # A worker died and took the pool with it. Drop it (unless another job
+    # already has) so the next get_page_pool() starts a fresh one.
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+    return get_page_pool()
+
+
+def convert_pages_parallel(filename, page_numbers, font_name_map, target_width, emit, on_page=None,
+                           table_backend=None):
+    pool = get_page_pool()
+    total = len(page_numbers)
+    # Small ranges keep progress moving and balance uneven pages across workers
+    pages_per_task = max(1, min(MAX_PAGES_PER_TASK, -(-total // CONVERSION_WORKERS)))
+    chunks = iter([page_numbers[i:i + pages_per_task] for i in range(0, total, pages_per_task)])
+    # Bounded window: at most this many chunks are running or finished but
+    # waiting on an earlier one, so memory does not grow with document length
+    window = CONVERSION_WORKERS * TASKS_IN_FLIGHT_PER_WORKER
+    in_flight = {}  # future -> (chunk index, page numbers, pool)
+    pending = {}
+    retries = {}
+    submitted = 0
+    next_chunk = 0
+    done = 0
+    pages_skipped = 0
+
+    def submit(index, chunk):
+        nonlocal pool
+        try:
+            future = pool.submit(convert_page_list, filename, chunk, font_name_map, target_width, table_backend)
+        except BrokenProcessPool:
+            # Broken by a crash in another job's chunk
+            pool = replace_broken_pool(pool)
+            future = pool.submit(convert_page_list, filename, chunk, font_name_map, target_width, table_backend)
+        in_flight[future] = (index, chunk, pool)
+
+    def fill_window():
+        nonlocal submitted
+        while len(in_flight) + len(pending) < window:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            submit(submitted, chunk)
+            submitted += 1
+
+    fill_window()
+    while in_flight:
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            index, chunk, chunk_pool = in_flight.pop(future)
+            try:
+                pages, chunk_skipped = future.result()
+            except BrokenProcessPool:
+                retries[index] = retries.get(index, 0) + 1
+                if retries[index] > MAX_CHUNK_RETRIES:
+                    raise
+                logger.warning("Page worker died on pages %d-%d; retrying on a fresh pool",
+                               chunk[0] + 1, chunk[-1] + 1)
+                if chunk_pool is pool:
+                    pool = replace_broken_pool(pool)
+                submit(index, chunk)
+                continue
+            pending[index] = pages
+            done += len(pages)
+            pages_skipped += chunk_skipped
+        # Chunks finish out of order; emit whatever is now contiguous
+        while next_chunk in pending:
+            for page in pending.pop(next_chunk):
+                emit(page)
+            next_chunk += 1
+        if on_page:
+            on_page(done, total)
+        fill_window()
+    log_table_prescreen(pages_skipped, total)
+    return pages_skipped
+
+
+def preload():
+    # Import the libraries the conversion modules load on first use, so the
+    # first job does not pay for them; runs in the app and in pool workers
+    import numpy  # noqa: F401
+    import pdfplumber  # noqa: F401
+    from PIL import Image  # noqa: F401
+    from fontTools.subset import Subsetter  # noqa: F401
+    return os.getpid()
+
+
+def prewarm():
+    # Load the conversion stack in this process and, when pages run in
+    # parallel, spawn every pool worker and have it do the same. Returns the
+    # workers' futures.
+    preload()
+    if CONVERSION_WORKERS <= 1:
+        return []
+    pool = get_page_pool()
+    # Each submit finds no idle worker yet and spawns a new one
+    return [pool.submit(preload) for _ in range(CONVERSION_WORKERS)]
+
+
+def use_parallel(total_pages):
+    return CONVERSION_WORKERS > 1 and total_pages >= PARALLEL_MIN_PAGES
+
+
+# ---------- PARALLEL WORKER ----------
+def convert_page_list(filename, page_numbers, font_name_map, target_width, table_backend=None):
+    # Runs inside a pool process: open private fitz/table detector handles and
+    # return the converted Pages in order, plus how many pages the table
+    # pre-screen skipped
+    pdf_doc = fitz.open(filename)
+    table_detector = open_table_detector(filename, table_backend)
+    image_store = ImageAssetStore(pdf_doc)
+    try:
+        pages = [
+            convert_page(pdf_doc[page_num], table_detector, font_name_map, target_width, image_store)
+            for page_num in page_numbers
+        ]
+        return pages, table_detector.pages_skipped
+    finally:
+        table_detector.close()
+        pdf_doc.close()
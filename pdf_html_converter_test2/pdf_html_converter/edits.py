@@ -0,0 +1,64 @@
+import os
+import threading
+from model import TextElement, ImageElement, split_text_style
+from writer import STALE_MARKER, save_page, load_page, read_manifest, manifest_page_numbers
+
+# Fields a patch may set on each element type
+PATCHABLE_FIELDS = {TextElement: ("text", "style"), ImageElement: ("style",)}
+
+# A text style's font part ends up inside a <style> rule in compact output,
+# where attribute escaping does not apply
+UNSAFE_STYLE_CHARS = ('"', "<", ">", "{", "}")
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class PatchError(Exception):
+    pass
+
+
+def job_lock(pages_dir):
+    # Edits to one job are applied one at a time
+    with _locks_guard:
+        return _locks.setdefault(pages_dir, threading.Lock())
+
+
+# ---------- PAGE PATCHES ----------
+def apply_patch(element, patch):
+    allowed = PATCHABLE_FIELDS.get(type(element))
+    if allowed is None:
+        raise PatchError(f"{type(element).__name__} elements cannot be edited")
+    unknown = set(patch) - set(allowed) - {"element"}
+    if unknown:
+        raise PatchError(f"Cannot set {', '.join(sorted(unknown))} on {type(element).__name__}")
+    if "text" in patch:
+        element.text = str(patch["text"])
+    if "style" in patch:
+        if any(char in str(patch["style"]) for char in UNSAFE_STYLE_CHARS):
+            raise PatchError(f"Style may not contain {' '.join(UNSAFE_STYLE_CHARS)}")
+        if isinstance(element, TextElement):
+            element.position, element.font_style = split_text_style(str(patch["style"]))
+        else:
+            element.style = str(patch["style"])
+
+
+def patch_page(pages_dir, page_number, patches):
+    # patches: [{"element": index in the page's JSON elements, "text"/"style": new value}]
+    # Only this page's model and fragment are rewritten; the whole-document
+    # files are marked stale and rebuilt from the pages when next read.
+    # Returns the patched elements as JSON.
+    manifest = read_manifest(pages_dir)
+    if page_number not in manifest_page_numbers(manifest):
+        raise PatchError(f"Page {page_number} does not exist")
+    with job_lock(pages_dir):
+        page = load_page(pages_dir, page_number)
+        for patch in patches:
+            index = patch.get("element")
+            # bool is an int subclass: JSON true must not mean element 1
+            if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(page.elements):
+                raise PatchError(f"Page {page_number} has no element {index}")
+            apply_patch(page.elements[index], patch)
+        save_page(pages_dir, page, manifest.get("compact_html", False))
+        open(os.path.join(pages_dir, STALE_MARKER), "w").close()
+    return [page.elements[patch["element"]].to_json() for patch in patches]
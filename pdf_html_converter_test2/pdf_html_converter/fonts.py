@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import logging
+import hashlib
+import threading
+from io import BytesIO
+from writer import write_bytes_atomic
+# fontTools is imported on first use, where a font is parsed or subset
+
+try:
+    import brotli  # noqa: F401  (needed by fontTools for WOFF2)
+    SUBSET_FLAVOR = "woff2"
+except ImportError:
+    SUBSET_FLAVOR = "woff"
+
+logger = logging.getLogger(__name__)
+# fontTools warns for every table it drops while subsetting
+logging.getLogger("fontTools.subset").setLevel(logging.ERROR)
+
+FONT_FOLDER = os.path.join("output", "fonts")
+FONT_URL_PREFIX = "/fonts/"
+# Embedded formats browsers can load; bare CFF and Type1 programs are skipped
+WEB_FONT_FORMATS = {"ttf": "truetype", "otf": "opentype", "woff": "woff", "woff2": "woff2"}
+FONT_MIME_TYPES = {"ttf": "font/ttf", "otf": "font/otf", "woff": "font/woff", "woff2": "font/woff2"}
+
+SUBSET_PREFIX = re.compile(r'^[A-Z]{6}\+')
+STYLE_SUFFIX = re.compile(r'[, \-](bold|italic|oblique)', flags=re.IGNORECASE)
+# Font names come from the PDF and end up quoted inside <style> blocks and
+# style attributes; anything that could close the string, rule or element goes
+UNSAFE_FONT_CHARS = re.compile(r'[\'"<>{};\\\x00-\x1f\x7f]')
+
+
+def strip_subset_prefix(name):
+    # "BCDEEE+TimesNewRomanPSMT" -> "TimesNewRomanPSMT", as spans report it
+    return SUBSET_PREFIX.sub('', name)
+
+
+def normalize_font_name(name):
+    # -> the CSS family name; every family in the output passes through here
+    return UNSAFE_FONT_CHARS.sub('', STYLE_SUFFIX.sub('', name)).strip()
+
+
+def unicode_range(codepoints):
+    # Collapse codepoints into the compact U+XXXX-YYYY form used by @font-face
+    ranges = []
+    for cp in sorted(codepoints):
+        if ranges and cp == ranges[-1][1] + 1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return ", ".join(f"U+{a:X}" if a == b else f"U+{a:X}-{b:X}" for a, b in ranges)
+
+
+# ---------- FONT ASSET CACHE ----------
+class FontCache:
+    # Keyed by the SHA-256 of the embedded font program, shared by all jobs:
+    # <hash>.json holds the parsed metadata, <hash>-<charset hash>.<flavor>
+    # a subset. A font seen before is never parsed or subset again.
+
+    def __init__(self, font_folder=FONT_FOLDER):
+        self.font_folder = font_folder
+        self._metadata = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.font_folder, exist_ok=True)
+
+    def _meta_path(self, name):
+        return os.path.join(self.font_folder, f"{name}.json")
+
+    def _load_json(self, name):
+        try:
+            with open(self._meta_path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_json(self, name, data):
+        write_bytes_atomic(self._meta_path(name), json.dumps(data).encode("utf-8"))
+
+    def metadata(self, font_hash, font_bytes, fallback_name):
+        with self._lock:
+            meta = self._metadata.get(font_hash)
+        if meta is None:
+            meta = self._load_json(font_hash)
+        if meta is None:
+            meta = {"display_name": fallback_name, "codepoints": None}
+            try:
+                from fontTools.ttLib import TTFont
+                tt = TTFont(BytesIO(font_bytes), lazy=True)
+                name_record = tt['name'].getName(4, 3, 1, 1033) or tt['name'].getName(4, 1, 0, 0)
+                if name_record:
+                    meta["display_name"] = str(name_record)
+                cmap = tt.getBestCmap()
+                meta["codepoints"] = sorted(cmap) if cmap else []
+                # Only a successful parse is persisted; the fallback record
+                # is kept for this process alone
+                self._save_json(font_hash, meta)
+            except Exception as e:
+                logger.warning("Could not read font %s: %s", fallback_name, e)
+        with self._lock:
+            self._metadata[font_hash] = meta
+        return meta
+
+    def subset(self, font_hash, font_bytes, codepoints):
+        # Returns the asset file name of the font cut down to `codepoints`
+        charset_hash = hashlib.sha256(",".join(map(str, sorted(codepoints))).encode("ascii")).hexdigest()[:16]
+        name = f"{font_hash}-{charset_hash}.{SUBSET_FLAVOR}"
+        path = os.path.join(self.font_folder, name)
+        if os.path.exists(path):
+            return name
+
+        from fontTools.ttLib import TTFont
+        from fontTools.subset import Options, Subsetter
+        options = Options()
+        options.flavor = SUBSET_FLAVOR
+        options.name_IDs = ["*"]
+        options.notdef_outline = True
+        options.ignore_missing_unicodes = True
+        tt = TTFont(BytesIO(font_bytes))
+        subsetter = Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(tt)
+        out = BytesIO()
+        tt.flavor = SUBSET_FLAVOR
+        tt.save(out)
+        write_bytes_atomic(path, out.getvalue())
+        return name
+
+    def original(self, font_hash, font_bytes, ext):
+        name = f"{font_hash}.{ext}"
+        path = os.path.join(self.font_folder, name)
+        if not os.path.exists(path):
+            write_bytes_atomic(path, font_bytes)
+        return name
+
+
+font_cache = FontCache()
+
+
+# ---------- DOCUMENT FONTS ----------
+class DocumentFonts:
+    # Collects a document's embedded fonts up front (name_map is what the
+    # page converter needs), records the characters spans actually use, and
+    # emits @font-face rules for the subset assets at the end.
+
+    def __init__(self, pdf_doc, cache=font_cache, url_prefix=FONT_URL_PREFIX):
+        self.cache = cache
+        self.url_prefix = url_prefix
+        self.name_map = {}
+        self.fonts = []
+        self.used_chars = {}
+        seen = set()
+        for page in pdf_doc:
+            try:
+                page_fonts = page.get_fonts(full=True)
+            except Exception as e:
+                logger.warning("Could not list fonts on page %d: %s", page.number, e)
+                continue
+            for font in page_fonts:
+                xref, internal_name = font[0], font[3]
+                if not internal_name or xref in seen:
+                    continue
+                seen.add(xref)
+                try:
+                    self._add_font(pdf_doc, xref, internal_name)
+                except Exception as e:
+                    logger.warning("Could not extract font %s: %s", internal_name, e)
+
+    def _add_font(self, pdf_doc, xref, internal_name):
+        _, ext, _, font_bytes = pdf_doc.extract_font(xref)
+        span_name = strip_subset_prefix(internal_name)
+        display_name = span_name
+        if font_bytes and ext in WEB_FONT_FORMATS:
+            font_hash = hashlib.sha256(font_bytes).hexdigest()
+            meta = self.cache.metadata(font_hash, font_bytes, span_name)
+            display_name = meta["display_name"]
+            lowered = internal_name.lower()
+            self.fonts.append({
+                "hash": font_hash,
+                "bytes": font_bytes,
+                "ext": ext,
+                "span_name": span_name,
+                "codepoints": meta["codepoints"],
+                "bold": "bold" in lowered,
+                "italic": "italic" in lowered or "oblique" in lowered
+            })
+        normalized = normalize_font_name(display_name)
+        # Spans report the font without the subset tag, so map both forms
+        self.name_map.setdefault(internal_name, normalized)
+        self.name_map.setdefault(span_name, normalized)
+
+    def add_chars(self, font_chars):
+        # font_chars: {span font name: set of characters}
+        for name, chars in font_chars.items():
+            self.used_chars.setdefault(name, set()).update(chars)
+
+    def css(self):
+        rules = []
+        for font in self.fonts:
+            used = {ord(ch) for ch in self.used_chars.get(font["span_name"], ())}
+            if not used:
+                continue
+            family = self.name_map[font["span_name"]]
+            covered = used.intersection(font["codepoints"]) if font["codepoints"] is not None else used
+            if not covered:
+                continue
+            try:
+                name = self.cache.subset(font["hash"], font["bytes"], covered)
+                fmt = SUBSET_FLAVOR
+            except Exception as e:
+                logger.warning("Could not subset font %s, serving it whole: %s", font["span_name"], e)
+                name = self.cache.original(font["hash"], font["bytes"], font["ext"])
+                fmt = WEB_FONT_FORMATS[font["ext"]]
+            # unicode-range lets several subsets of one family combine
+            rules.append(
+                f"@font-face {{ font-family: '{family}'; "
+                f"src: url({self.url_prefix}{name}) format('{fmt}'); "
+                f"font-weight: {'bold' if font['bold'] else 'normal'}; "
+                f"font-style: {'italic' if font['italic'] else 'normal'}; "
+                f"unicode-range: {unicode_range(covered)}; }}"
+            )
+        return "\n".join(rules)
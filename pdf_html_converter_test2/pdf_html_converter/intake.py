@@ -0,0 +1,96 @@
+import os
+import hashlib
+import tempfile
+import threading
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from validation import MAX_FILE_SIZE_MB
+
+UPLOAD_FOLDER = "uploads"
+MAX_UPLOAD_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# Room for the multipart boundaries and form fields around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def upload_lock(path):
+    # Storing an upload and deleting an unused one are serialized per file,
+    # so a file is never removed between another request storing it and
+    # recording a job for it
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+# ---------- STREAMING UPLOAD ----------
+class HashingUpload:
+    # Werkzeug writes the uploaded file into this in chunks as it parses the
+    # request body: the size limit is enforced and the SHA-256 computed on the
+    # fly, and nothing is ever buffered whole in memory or in a second copy.
+
+    def __init__(self, upload_folder=UPLOAD_FOLDER, max_bytes=MAX_UPLOAD_BYTES):
+        os.makedirs(upload_folder, exist_ok=True)
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.path = None
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=upload_folder, suffix=".part")
+        self._file = os.fdopen(fd, "w+b")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f"File size exceeds {MAX_FILE_SIZE_MB} MB")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # seek/read/tell/flush for werkzeug's FileStorage
+        return getattr(self._file, name)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def stored_path(self):
+        # Where store() puts the file
+        return os.path.join(self.upload_folder, f"{self.sha256}.pdf")
+
+    def store(self):
+        # Move the upload to uploads/<sha256>.pdf. Names never collide between
+        # different files, and a file uploaded twice is stored once.
+        self._file.close()
+        path = self.stored_path
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+        else:
+            os.chmod(self._tmp_path, 0o644)
+            os.replace(self._tmp_path, path)
+        self.path = path
+        return path
+
+    def close(self):
+        # Called when the request ends: drop the partial file unless stored
+        self._file.close()
+        if self.path is None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class StreamingUploadRequest(Request):
+    # Bodies over the limit are refused from Content-Length before any of
+    # them is read; chunked bodies are cut off by HashingUpload.write()
+    max_content_length = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = HashingUpload()
+        self._uploads = getattr(self, "_uploads", []) + [upload]
+        return upload
+
+    def close(self):
+        super().close()
+        for upload in getattr(self, "_uploads", ()):
+            upload.close()
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+
+JOB_DB_PATH = os.path.join("output", "jobs.sqlite3")
+# Jobs untouched for this long are dropped together with their output files
+JOB_TTL_SECONDS = 24 * 60 * 60
+# Budget for the output files of all stored jobs; oldest finished jobs go first
+MAX_JOB_STORAGE_MB = 1024
+# Run the (cheap) eviction sweep at most this often
+EVICTION_INTERVAL_SECONDS = 60
+
+JOB_FIELDS = (
+    "status", "progress", "message", "error", "pdf_path", "result_path",
+    "artifacts", "output_bytes", "metrics", "owner_pid", "created_at", "updated_at"
+)
+# Columns stored as JSON text
+JSON_FIELDS = ("artifacts", "metrics")
+FINISHED_STATUSES = ("completed", "error")
+# The small subset of a job record sent to progress clients
+PROGRESS_FIELDS = ("status", "progress", "message", "error")
+# How long a progress watcher waits for an event before re-checking the store
+WATCH_TIMEOUT_SECONDS = 5
+INTERRUPTED_MESSAGE = "Interrupted by restart"
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def path_size(path):
+    # Artifacts are files or directories (a job's per-page fragments)
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path) for name in names
+        )
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+# ---------- JOB STORE ----------
+class JobStore:
+    # Job status records live in SQLite (WAL mode), so any thread or worker
+    # process can read and update them and they survive restarts. Large
+    # payloads are never stored here: only paths to files on disk.
+    # Updates are also pushed to in-process watchers (see watch()), along with
+    # transient per-stage events that are never written to the database.
+
+    def __init__(self, db_path=JOB_DB_PATH, ttl_seconds=JOB_TTL_SECONDS, max_storage_mb=MAX_JOB_STORAGE_MB):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_storage_bytes = int(max_storage_mb * 1024 * 1024)
+        self._local = threading.local()
+        self._last_eviction = 0
+        self._events = {}
+        self._events_cond = threading.Condition()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    error TEXT,
+                    pdf_path TEXT,
+                    result_path TEXT,
+                    artifacts TEXT NOT NULL DEFAULT '[]',
+                    output_bytes INTEGER NOT NULL DEFAULT 0,
+                    metrics TEXT NOT NULL DEFAULT '{}',
+                    owner_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "metrics" not in columns:
+                # Databases created before per-job metrics existed
+                conn.execute("ALTER TABLE jobs ADD COLUMN metrics TEXT NOT NULL DEFAULT '{}'")
+            if "owner_pid" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+        self.fail_interrupted()
+
+    def _connect(self):
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job_id, **fields):
+        now = time.time()
+        record = {
+            "status": "starting", "progress": 0, "message": "Initializing conversion...",
+            "error": None, "pdf_path": None, "result_path": None, "artifacts": [],
+            "output_bytes": 0, "metrics": {}, "owner_pid": os.getpid(), "created_at": now, "updated_at": now
+        }
+        record.update(fields)
+        for field in JSON_FIELDS:
+            record[field] = json.dumps(record[field])
+        columns = ", ".join(("job_id",) + JOB_FIELDS)
+        placeholders = ", ".join("?" * (len(JOB_FIELDS) + 1))
+        self._connect().execute(
+            f"INSERT OR REPLACE INTO jobs ({columns}) VALUES ({placeholders})",
+            [job_id] + [record[field] for field in JOB_FIELDS]
+        )
+        self.evict()
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        if "artifacts" in fields:
+            fields["output_bytes"] = sum(path_size(path) for path in fields["artifacts"])
+        for field in JSON_FIELDS:
+            if field in fields:
+                fields[field] = json.dumps(fields[field])
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        self._connect().execute(
+            f"UPDATE jobs SET {assignments} WHERE job_id = ?", list(fields.values()) + [job_id]
+        )
+        self._publish(job_id, {}, finished=fields.get("status") in FINISHED_STATUSES)
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for field in JSON_FIELDS:
+            job[field] = json.loads(job[field])
+        return job
+
+    def __contains__(self, job_id):
+        return self._connect().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def fail_interrupted(self):
+        # The scheduler queue lives in memory, so an unfinished job whose
+        # process is gone (a restart or crash) will never finish. Jobs of
+        # other live processes sharing the database are left alone. Runs
+        # before this store creates any job, so rows with our own pid are
+        # from an earlier process that had it (e.g. pid 1 in a container).
+        conn = self._connect()
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        rows = conn.execute(
+            f"SELECT job_id, owner_pid FROM jobs WHERE status NOT IN ({placeholders})", FINISHED_STATUSES
+        ).fetchall()
+        for row in rows:
+            pid = row["owner_pid"]
+            if pid is None or pid == os.getpid() or not process_alive(pid):
+                self.update(row["job_id"], status="error", error=INTERRUPTED_MESSAGE,
+                            message=f"Error: {INTERRUPTED_MESSAGE}")
+
+    def uses_pdf(self, pdf_path):
+        # True while any job record (queued, running or finished) points at
+        # this upload; uploads are stored once per content hash and shared
+        return self._connect().execute(
+            "SELECT 1 FROM jobs WHERE pdf_path = ? LIMIT 1", (pdf_path,)
+        ).fetchone() is not None
+
+    def delete(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return
+        for path in job["artifacts"]:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        with self._events_cond:
+            self._events.pop(job_id, None)
+            self._events_cond.notify_all()
+
+    def evict(self, force=False):
+        now = time.time()
+        if not force and now - self._last_eviction < EVICTION_INTERVAL_SECONDS:
+            return
+        self._last_eviction = now
+        conn = self._connect()
+
+        expired = conn.execute(
+            "SELECT job_id FROM jobs WHERE updated_at < ?", (now - self.ttl_seconds,)
+        ).fetchall()
+        for row in expired:
+            self.delete(row["job_id"])
+
+        total = conn.execute("SELECT COALESCE(SUM(output_bytes), 0) FROM jobs").fetchone()[0]
+        if total <= self.max_storage_bytes:
+            return
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        oldest = conn.execute(
+            f"SELECT job_id, output_bytes FROM jobs WHERE status IN ({placeholders}) ORDER BY updated_at",
+            FINISHED_STATUSES
+        ).fetchall()
+        for row in oldest:
+            if total <= self.max_storage_bytes:
+                break
+            self.delete(row["job_id"])
+            total -= row["output_bytes"]
+
+    # ---------- PROGRESS EVENTS ----------
+    def _seq(self, job_id):
+        event = self._events.get(job_id)
+        return event["seq"] if event else None
+
+    def _publish(self, job_id, transient, finished=False):
+        with self._events_cond:
+            event = self._events.setdefault(job_id, {"seq": 0, "transient": {}})
+            event["seq"] += 1
+            event["transient"].update(transient)
+            if finished:
+                # Watchers wake on the seq change and read the final state from
+                # the store; nothing per-job is left behind in memory
+                del self._events[job_id]
+            self._events_cond.notify_all()
+
+    def notify(self, job_id, **transient):
+        # Push a per-stage event (stage, page, total_pages) without a DB write
+        self._publish(job_id, transient)
+
+    def progress(self, job_id):
+        # Small progress payload: never includes paths or document bodies
+        job = self.get(job_id)
+        if job is None:
+            return None
+        payload = {field: job[field] for field in PROGRESS_FIELDS}
+        with self._events_cond:
+            event = self._events.get(job_id)
+            if event:
+                payload.update(event["transient"])
+        return payload
+
+    def watch(self, job_id, timeout=WATCH_TIMEOUT_SECONDS):
+        # Yields the progress payload after every event for this job, or after
+        # `timeout` seconds without one (updates written by other processes
+        # are picked up then). Stops once the job is finished or gone.
+        while True:
+            with self._events_cond:
+                seq = self._seq(job_id)
+            payload = self.progress(job_id)
+            if payload is None:
+                return
+            yield payload
+            if payload["status"] in FINISHED_STATUSES:
+                return
+            with self._events_cond:
+                self._events_cond.wait_for(lambda: self._seq(job_id) != seq, timeout)
@@ -0,0 +1,179 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Per-job counters, also summed into conversion_<name>_total
+JOB_COUNTERS = ("pages", "spans", "images", "tables", "table_pages_skipped", "bytes_emitted")
+
+
+# ---------- STAGE TIMING ----------
+class StageTimer:
+    # Splits one piece of work (a page) into consecutive named stages.
+    # Two perf_counter() calls per stage, so it is always on.
+
+    def __init__(self, on_stage=None):
+        self.on_stage = on_stage
+        self.timings = {}
+        self._stage = None
+        self._start = 0.0
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self._stage:
+            self.timings[self._stage] = self.timings.get(self._stage, 0.0) + now - self._start
+        self._stage = stage
+        self._start = now
+        if stage and self.on_stage:
+            self.on_stage(stage)
+
+    def stop(self):
+        self.enter(None)
+        return self.timings
+
+
+class JobMetrics:
+    # Stage seconds and counters for one job; stored as JSON on the job
+    # record and folded into the process-wide histograms when the job ends
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = dict.fromkeys(JOB_COUNTERS, 0)
+        self._start = time.perf_counter()
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - start)
+
+    def add_page(self, page):
+        # page.timings comes back from pool workers with the Page itself
+        for stage, seconds in page.timings.items():
+            self.add_stage(stage, seconds)
+        self.counters["pages"] += 1
+        for element in page.elements:
+            kind = type(element).__name__
+            if kind == "TextElement":
+                self.counters["spans"] += 1
+            elif kind == "ImageElement":
+                self.counters["images"] += 1
+            elif kind == "TableElement":
+                self.counters["tables"] += 1
+
+    def total_seconds(self):
+        return time.perf_counter() - self._start
+
+    def to_json(self):
+        return {
+            "total_seconds": round(self.total_seconds(), 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters)
+        }
+
+
+# ---------- PROMETHEUS METRICS ----------
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {series[len(self.buckets)]}")
+                lines.append(f"{self.name}_sum{_labels(key)} {round(series[-1], 6)}")
+                lines.append(f"{self.name}_count{_labels(key)} {series[len(self.buckets)]}")
+        return lines
+
+
+class MetricsRegistry:
+    # Process-wide aggregates, rendered in the Prometheus text format.
+    # Gauges are read from callbacks at scrape time.
+
+    def __init__(self):
+        self.job_seconds = Histogram("conversion_job_seconds", "Wall time of a conversion job")
+        self.stage_seconds = Histogram("conversion_stage_seconds", "Wall time spent in a stage, per job")
+        self.jobs = Counter("conversion_jobs_total", "Finished conversion jobs")
+        self.counters = {
+            name: Counter(f"conversion_{name}_total", f"{name.replace('_', ' ').capitalize()} over all jobs")
+            for name in JOB_COUNTERS
+        }
+        self._gauges = []
+
+    def add_gauges(self, prefix, read):
+        # read() returns {name: number}; each becomes <prefix>_<name>
+        self._gauges.append((prefix, read))
+
+    def observe_job(self, job_metrics, status, cached=False):
+        self.job_seconds.observe(job_metrics.total_seconds(), status=status, cached=str(cached).lower())
+        for stage, seconds in job_metrics.stages.items():
+            self.stage_seconds.observe(seconds, stage=stage)
+        self.jobs.inc(status=status, cached=str(cached).lower())
+        for name, value in job_metrics.counters.items():
+            if value:
+                self.counters[name].inc(value)
+
+    def render(self):
+        lines = []
+        for metric in (self.jobs, self.job_seconds, self.stage_seconds, *self.counters.values()):
+            lines.extend(metric.render())
+        for prefix, read in self._gauges:
+            for name, value in read().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{name} gauge")
+                    lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
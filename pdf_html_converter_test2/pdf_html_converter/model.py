@@ -0,0 +1,203 @@
+import html
+import re
+import hashlib
+
+URL_PATTERN = re.compile(r'(https?://[^\s<]+)')
+
+
+def style_class_name(font_style):
+    return "s" + hashlib.sha1(font_style.encode("utf-8")).hexdigest()[:8]
+
+
+def attr(value):
+    # Attribute values are escaped like text: styles can come from edits
+    return html.escape(value, quote=True)
+
+
+def split_text_style(style):
+    # Inverse of TextElement.style: position (top/left/right) comes first,
+    # the font properties start at font-size
+    index = style.find("font-size:")
+    if index < 0:
+        return style, ""
+    return style[:index], style[index:]
+
+
+# ---------- PAGE / ELEMENT MODEL ----------
+# Built once during extraction; both the HTML output and the JSON document
+# (document.pages[].elements[]) are serialized from it.
+class TextElement:
+    # position holds top/left/right, font_style the rest of the inline style;
+    # compact output moves font_style into a shared CSS class
+    __slots__ = ("position", "font_style", "text")
+
+    def __init__(self, position, font_style, text):
+        self.position = position
+        self.font_style = font_style
+        self.text = text
+
+    @property
+    def style(self):
+        return self.position + self.font_style
+
+    def _text_html(self):
+        # Preserve URLs inside text; the regex only runs on spans that can
+        # contain one
+        text = html.escape(self.text)
+        if "http" not in text:
+            return text
+        return URL_PATTERN.sub(r'<a href="\1" target="_blank">\1</a>', text)
+
+    def to_html(self):
+        return f'<div class="positioned-text" style="{attr(self.style)}">{self._text_html()}</div>'
+
+    def to_compact_html(self, class_name):
+        return f'<div class="positioned-text {class_name}" style="{attr(self.position)}">{self._text_html()}</div>'
+
+    def to_json(self):
+        return {"type": "text", "text": self.text, "style": self.style}
+
+
+class ImageElement:
+    __slots__ = ("style", "src")
+
+    def __init__(self, style, src):
+        self.style = style
+        self.src = src
+
+    def to_html(self):
+        return f'''
+            <div class="positioned-image" style="{attr(self.style)}">
+                <img src="{attr(self.src)}" style="width: 100%; height: 100%; object-fit: contain;">
+            </div>
+        '''
+
+    def to_json(self):
+        return {"type": "image", "style": self.style, "src": self.src}
+
+
+class TableElement:
+    # rows: list of rows, each a list of (text, rowspan, colspan) cells in
+    # output order; spans are None when 1
+    __slots__ = ("top", "left", "width", "height", "rows")
+
+    def __init__(self, top, left, width, height, rows):
+        self.top = top
+        self.left = left
+        self.width = width
+        self.height = height
+        self.rows = rows
+
+    def to_html(self):
+        parts = ["<table>"]
+        for row in self.rows:
+            parts.append("<tr>")
+            for text, rowspan, colspan in row:
+                attributes = ""
+                if rowspan:
+                    attributes += f' rowspan="{rowspan}"'
+                if colspan:
+                    attributes += f' colspan="{colspan}"'
+                parts.append(f"<td{attributes}>{html.escape(text)}</td>")
+            parts.append("</tr>")
+        parts.append("</table>")
+        return f"""
+        <div style="position: absolute; top: {self.top}px; left: {self.left}px;
+                    width: {self.width}px; height: {self.height}px;">
+            {"".join(parts)}
+        </div>
+        """
+
+    def to_json(self):
+        return {
+            "type": "table",
+            "rows": [
+                [
+                    {
+                        "text": text.strip(),
+                        "rowspan": str(rowspan) if rowspan else None,
+                        "colspan": str(colspan) if colspan else None
+                    }
+                    for text, rowspan, colspan in row
+                ]
+                for row in self.rows
+            ]
+        }
+
+
+class Page:
+    # font_chars ({span font name: set of chars}) feeds font subsetting and
+    # timings ({stage: seconds}) the job metrics; neither is serialized
+    __slots__ = ("number", "height", "elements", "font_chars", "timings")
+
+    def __init__(self, number, height, elements, font_chars=None, timings=None):
+        self.number = number
+        self.height = height
+        self.elements = elements
+        self.font_chars = font_chars or {}
+        self.timings = timings or {}
+
+    def to_html(self, compact=False):
+        if compact:
+            return self._to_compact_html()
+        return f'''
+    <div class="page-container" style="height: {self.height}px;">
+        {"".join(element.to_html() for element in self.elements)}
+    </div>
+    '''
+
+    def _to_compact_html(self):
+        # Each distinct text style becomes one class in a page-local <style>.
+        # Names are a hash of the style, so pages converted in different
+        # workers agree and a fragment stays self-contained.
+        classes = {}
+        parts = []
+        for element in self.elements:
+            if isinstance(element, TextElement):
+                class_name = classes.get(element.font_style)
+                if class_name is None:
+                    class_name = style_class_name(element.font_style)
+                    classes[element.font_style] = class_name
+                parts.append(element.to_compact_html(class_name))
+            else:
+                parts.append(element.to_html())
+        rules = "".join(f".{name} {{{font_style}}}" for font_style, name in classes.items())
+        style = f"<style>{rules}</style>" if rules else ""
+        return f'''
+    <div class="page-container" style="height: {self.height}px;">{style}{"".join(parts)}</div>
+    '''
+
+    def to_json(self):
+        return {
+            "page_number": self.number,
+            "elements": [element.to_json() for element in self.elements]
+        }
+
+
+# ---------- STORED PAGE MODEL ----------
+# The JSON form of a Page kept next to its fragment, so an edit can re-render
+# one page without parsing HTML. Unlike the document JSON it keeps the page
+# height, table geometry and the table cells exactly as extracted.
+def page_to_model(page):
+    elements = []
+    for element in page.elements:
+        data = element.to_json()
+        if isinstance(element, TableElement):
+            data.update(top=element.top, left=element.left, width=element.width,
+                        height=element.height, rows=element.rows)
+        elements.append(data)
+    return {"page_number": page.number, "height": page.height, "elements": elements}
+
+
+def page_from_model(data):
+    elements = []
+    for element in data["elements"]:
+        if element["type"] == "text":
+            elements.append(TextElement(*split_text_style(element["style"]), element["text"]))
+        elif element["type"] == "image":
+            elements.append(ImageElement(element["style"], element["src"]))
+        else:
+            rows = [[tuple(cell) for cell in row] for row in element["rows"]]
+            elements.append(TableElement(element["top"], element["left"], element["width"],
+                                         element["height"], rows))
+    return Page(data["page_number"], data["height"], elements)
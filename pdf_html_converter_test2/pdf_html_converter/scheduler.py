@@ -0,0 +1,106 @@
+import os
+import math
+import heapq
+import time
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 2))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 16))
+# Retry-After bounds (seconds) when the queue is full
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 300
+# Weight of the newest job in the running average of job durations
+DURATION_SMOOTHING = 0.2
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Conversion queue is full, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+# ---------- JOB SCHEDULER ----------
+class JobScheduler:
+    # A fixed set of worker threads pulls jobs from a priority queue (lower
+    # priority value first, FIFO within a priority). submit() refuses new work
+    # once MAX_QUEUED_JOBS are waiting instead of oversubscribing the box.
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max_queued
+        self.avg_duration = None
+        self._heap = []
+        self._queued = {}
+        self._running = set()
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job_id, fn, *args, priority=0):
+        with self._cond:
+            if len(self._queued) >= self.max_queued:
+                raise QueueFull(self.retry_after())
+            entry = (priority, next(self._counter), job_id, fn, args)
+            heapq.heappush(self._heap, entry)
+            self._queued[job_id] = entry
+            self._start_workers()
+            self._cond.notify()
+
+    def position(self, job_id):
+        # 1-based place in line, 0 once running, None if unknown
+        with self._cond:
+            if job_id in self._running:
+                return 0
+            entry = self._queued.get(job_id)
+            if entry is None:
+                return None
+            return 1 + sum(1 for other in self._queued.values() if other[:2] < entry[:2])
+
+    def retry_after(self):
+        # Rough time until a queue slot frees up, from the average job duration
+        if self.avg_duration is None:
+            return MAX_RETRY_AFTER // 10
+        estimate = self.avg_duration * (len(self._queued) + 1) / self.max_workers
+        return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(estimate))))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "running": len(self._running),
+                "queued": len(self._queued),
+                "max_queued": self.max_queued,
+                "avg_duration": self.avg_duration
+            }
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id, fn, args = heapq.heappop(self._heap)
+                del self._queued[job_id]
+                self._running.add(job_id)
+            start = time.time()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.exception("Job %s failed: %s", job_id, e)
+            finally:
+                duration = time.time() - start
+                with self._cond:
+                    self._running.discard(job_id)
+                    if self.avg_duration is None:
+                        self.avg_duration = duration
+                    else:
+                        self.avg_duration += DURATION_SMOOTHING * (duration - self.avg_duration)
@@ -0,0 +1,132 @@
+import fitz  # PyMuPDF
+import numpy as np
+from fonts import normalize_font_name
+from model import TextElement
+
+# Image blocks are never used for text; skipping them saves MuPDF from
+# copying every image's bytes into the dict
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+LEFT_PADDING = 0.8
+
+
+# ---------- COLUMNAR SPAN TABLE ----------
+class PageSpans:
+    # Every text span of a page in parallel columns, gathered in one pass
+    # over get_text("dict"): bbox and size as NumPy arrays, text, font ids
+    # and color as lists. Geometry is then computed for all spans at once.
+
+    def __init__(self, page_mupdf):
+        blocks = page_mupdf.get_text("dict", flags=TEXT_FLAGS)["blocks"]
+        lines = [line["spans"] for block in blocks if block["type"] == 0 for line in block["lines"]]
+        spans = [span for line in lines for span in line]
+        self.line_ids = [line_id for line_id, line in enumerate(lines) for _ in line]
+        self.texts = [span["text"] for span in spans]
+        font_index = {}  # internal font name -> font id
+        self.font_ids = [font_index.setdefault(span.get("font", "Arial"), len(font_index)) for span in spans]
+        self.fonts = list(font_index)
+        self.bbox = np.array([span["bbox"] for span in spans], dtype=np.float64).reshape(-1, 4)
+        self.size = np.array([span["size"] for span in spans], dtype=np.float64)
+        self.color = [span["color"] for span in spans]
+
+    def __len__(self):
+        return len(self.texts)
+
+
+# ---------- FONT RESOLUTION ----------
+class FontResolver:
+    # Memoized internal font name -> CSS font declarations; the name
+    # normalization regex runs once per font, not once per span
+
+    def __init__(self, font_name_map):
+        self.font_name_map = font_name_map
+        self._css = {}
+
+    def css(self, internal_font):
+        css = self._css.get(internal_font)
+        if css is None:
+            # Match to extracted font map considering original/raw names, then
+            # the normalized name as a backup
+            font_family = self.font_name_map.get(internal_font)
+            if not font_family:
+                norm_name = normalize_font_name(internal_font)
+                font_family = self.font_name_map.get(norm_name, norm_name)
+            # Detect bold/italic from original internal name
+            lower = internal_font.lower()
+            is_bold = "bold" in lower
+            is_italic = "italic" in lower or "oblique" in lower
+            css = self._css[internal_font] = (
+                f"font-family: '{font_family}', Arial, sans-serif; "
+                f"{'font-weight: bold;' if is_bold else ''}"
+                f"{'font-style: italic;' if is_italic else ''}"
+            )
+        return css
+
+
+# ---------- TEXT ELEMENTS ----------
+def text_elements(page_mupdf, table_index, font_name_map, scale, font_chars, compact=False, merge_gap=0.1):
+    # Positioned TextElements for a page, in reading order. font_chars is
+    # filled with the characters used per internal font name.
+    spans = PageSpans(page_mupdf)
+    if not len(spans):
+        return []
+    page_width = page_mupdf.rect.width
+    x0, y0, x1, y1 = spans.bbox.T
+
+    # Bulk geometry: padding from the widest span, then every coordinate
+    # scaled and rounded in one go
+    max_text_width = max(float((x1 - x0).max()), 0)
+    right_padding = max(1.0, (page_width - max_text_width) * scale / 50)
+    tops = np.round(y0 * scale, 1).tolist()
+    lefts = (np.round(x0 * scale, 1) + LEFT_PADDING).tolist()
+    rights = (np.round((page_width - x1) * scale, 1) + right_padding).tolist()
+    font_sizes = np.round(spans.size * scale, 1).tolist()
+    merge_gaps = (spans.size * merge_gap).tolist()
+    x0s = x0.tolist()
+    x1s = x1.tolist()
+    in_table = table_index.contains_all(spans.bbox).tolist() if table_index else [False] * len(spans)
+
+    resolver = FontResolver(font_name_map)
+    styles = {}  # (font id, font size, color) -> style string
+    elements = []
+    previous = None  # (element, index of its first span, index of the last) kept on this line
+    previous_line = -1
+    for i, text in enumerate(spans.texts):
+        if spans.line_ids[i] != previous_line:
+            previous_line = spans.line_ids[i]
+            previous = None
+        if in_table[i]:
+            previous = None
+            continue
+        # Blank spans only matter as glue between merged spans
+        blank = not text.strip()
+        if blank and not (compact and previous):
+            continue
+
+        font_id = spans.font_ids[i]
+        font_chars.setdefault(spans.fonts[font_id], set()).update(text)
+        style_key = (font_id, font_sizes[i], spans.color[i])
+        font_style = styles.get(style_key)
+        if font_style is None:
+            font_style = styles[style_key] = (
+                f"font-size: {font_sizes[i]:.2f}px; "
+                f"color: #{spans.color[i]:06x}; "
+                f"{resolver.css(spans.fonts[font_id])}"
+                f"white-space: pre;"
+            )
+
+        # Compact output: a span that continues the previous one on the same
+        # line (same style and baseline, no gap) joins its element
+        if (compact and previous and previous[0].font_style == font_style and tops[previous[1]] == tops[i]
+                and abs(x0s[i] - x1s[previous[2]]) <= merge_gaps[i]):
+            element, first, _ = previous
+            element.text += text
+            element.position = f"top: {tops[i]}px; left: {lefts[first]}px; right: {rights[i]}px; "
+            previous = (element, first, i)
+            continue
+        if blank:
+            continue
+
+        element = TextElement(f"top: {tops[i]}px; left: {lefts[i]}px; right: {rights[i]}px; ", font_style, text)
+        elements.append(element)
+        previous = (element, i, i)
+    return elements
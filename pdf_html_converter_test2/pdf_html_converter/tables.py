@@ -0,0 +1,197 @@
+import os
+# numpy and pdfplumber are imported on first use, in TableIndex.contains_all
+# and PdfplumberTableDetector._find_tables
+
+# Table detection backend: "pdfplumber" (the original) or "pymupdf", which
+# runs find_tables on the already open fitz page instead of parsing the file
+# a second time in Python. Jobs may pick one; this is the default.
+TABLE_BACKEND = os.environ.get("TABLE_BACKEND", "pdfplumber")
+# PyMuPDF's find_tables otherwise prints a pymupdf_layout suggestion to stdout
+os.environ.setdefault("PYMUPDF_SUGGEST_LAYOUT_ANALYZER", "0")
+# pdfplumber's default "lines" strategy needs ruling on both axes to form a cell
+MIN_RULING_EDGES = 2
+# Segments within this many points of horizontal/vertical count as ruling
+RULING_TOLERANCE = 1
+
+
+# ---------- TABLE SPATIAL INDEX ----------
+class TableIndex:
+    # Table bboxes of one page. Spans are tested all at once, one vectorized
+    # comparison per table; a page rarely has more than a handful of tables.
+
+    def __init__(self, bboxes):
+        self.bboxes = list(bboxes)
+
+    def __bool__(self):
+        return bool(self.bboxes)
+
+    def contains_all(self, span_bboxes):
+        # span_bboxes: (n, 4) array -> boolean array, True for spans lying
+        # entirely inside a table
+        import numpy as np
+        x0, y0, x1, y1 = span_bboxes.T
+        inside = np.zeros(len(span_bboxes), dtype=bool)
+        for tx0, ty0, tx1, ty1 in self.bboxes:
+            inside |= (x0 >= tx0) & (x1 <= tx1) & (y0 >= ty0) & (y1 <= ty1)
+        return inside
+
+
+# ---------- TABLE PRE-SCREEN ----------
+def may_contain_tables(page_mupdf):
+    # Count horizontal and vertical ruling in the page's vector graphics.
+    # Without at least two of each, find_tables() can never return a table.
+    horizontal = vertical = 0
+    for drawing in page_mupdf.get_drawings():
+        for item in drawing["items"]:
+            kind = item[0]
+            if kind == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) <= RULING_TOLERANCE:
+                    horizontal += 1
+                elif abs(p1.x - p2.x) <= RULING_TOLERANCE:
+                    vertical += 1
+            elif kind in ("re", "qu", "c"):
+                # Rect/quad sides and curve segments both become edges in
+                # pdfplumber; count them on both axes to stay conservative
+                horizontal += 2
+                vertical += 2
+            if horizontal >= MIN_RULING_EDGES and vertical >= MIN_RULING_EDGES:
+                return True
+    return False
+
+
+# ---------- DETECTION BACKENDS ----------
+# A detector returns the page's tables as objects with .bbox (x0, top, x1,
+# bottom in PDF points), .cells and .extract() -> rows of cell text, None
+# where a merged cell continues; pdfplumber and PyMuPDF tables both fit.
+class TableDetector:
+    # Shared part: pages that fail the pre-screen never reach the backend
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.pages_scanned = 0
+        self.pages_skipped = 0
+
+    def find_tables(self, page_mupdf):
+        # Tables stay valid (table.extract() needs the page) until the next call
+        self._release_page()
+        if not may_contain_tables(page_mupdf):
+            self.pages_skipped += 1
+            return []
+        self.pages_scanned += 1
+        return self._find_tables(page_mupdf)
+
+    def _find_tables(self, page_mupdf):
+        raise NotImplementedError
+
+    def _release_page(self):
+        pass
+
+    def close(self):
+        self._release_page()
+
+
+class PdfplumberTableDetector(TableDetector):
+    # Opens pdfplumber only when a page passes the pre-screen, and loads
+    # pdfplumber pages one at a time instead of parsing the whole document.
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self._pdf = None
+        self._page = None
+
+    def _find_tables(self, page_mupdf):
+        if self._pdf is None:
+            import pdfplumber
+            self._pdf = pdfplumber.open(self.filename)
+        self._page = self._pdf.pages[page_mupdf.number]
+        return self._page.find_tables()
+
+    def _release_page(self):
+        # Drop the parsed layout so memory does not grow with page count
+        if self._page is not None:
+            self._page.close()
+            self._page = None
+
+    def close(self):
+        super().close()
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+
+
+class PyMuPDFTableDetector(TableDetector):
+    # MuPDF's port of the pdfplumber algorithm, run on the fitz page
+
+    def _find_tables(self, page_mupdf):
+        return page_mupdf.find_tables().tables
+
+
+TABLE_BACKENDS = {"pdfplumber": PdfplumberTableDetector, "pymupdf": PyMuPDFTableDetector}
+
+
+def open_table_detector(filename, backend=None):
+    # backend: a TABLE_BACKENDS name, None for the TABLE_BACKEND default
+    return TABLE_BACKENDS[backend or TABLE_BACKEND](filename)
+
+
+# ---------- TABLE GRID ----------
+def table_rows(table_data):
+    # Rows of (text, rowspan, colspan) from extract() output, where None marks
+    # a cell covered by a merged neighbour to its left or above. Spans of 1
+    # are None; covered positions are left out of their row.
+    rows = len(table_data)
+    cols = max(len(row) for row in table_data) if table_data else 0
+    grid = [[None for _ in range(cols)] for _ in range(rows)]
+    occupied = set()
+
+    for row_idx, row in enumerate(table_data):
+        col_idx = 0
+        for cell_idx, cell in enumerate(row):
+            while (row_idx, col_idx) in occupied:
+                col_idx += 1
+            if col_idx >= cols:
+                break
+            if cell is None:
+                continue
+
+            rowspan = 1
+            colspan = 1
+
+            if cell_idx < len(row) - 1 and row[cell_idx + 1] is None:
+                next_col = col_idx + 1
+                while next_col < cols and (row_idx, next_col) not in occupied and (next_col >= len(row) or row[next_col] is None):
+                    colspan += 1
+                    next_col += 1
+
+            if row_idx < len(table_data) - 1 and len(table_data[row_idx + 1]) > col_idx and table_data[row_idx + 1][col_idx] is None:
+                next_row = row_idx + 1
+                while next_row < rows and (next_row, col_idx) not in occupied and (col_idx >= len(table_data[next_row]) or table_data[next_row][col_idx] is None):
+                    rowspan += 1
+                    next_row += 1
+
+            for r in range(row_idx, row_idx + rowspan):
+                for c in range(col_idx, col_idx + colspan):
+                    if r < rows and c < cols:
+                        occupied.add((r, c))
+
+            grid[row_idx][col_idx] = {
+                'content': cell or "",
+                'rowspan': rowspan if rowspan > 1 else None,
+                'colspan': colspan if colspan > 1 else None
+            }
+            col_idx += colspan
+
+    html_rows = []
+    for r_idx in range(rows):
+        row_cells = []
+        for c_idx in range(cols):
+            if (r_idx, c_idx) in occupied and grid[r_idx][c_idx] is None:
+                continue
+            cell = grid[r_idx][c_idx]
+            if cell:
+                row_cells.append((cell['content'], cell['rowspan'], cell['colspan']))
+            else:
+                row_cells.append(("", None, None))
+        html_rows.append(row_cells)
+    return html_rows
@@ -1,11 +1,50 @@
 import os
-import fitz  # PyMuPDF
 
 MAX_FILE_SIZE_MB = 100
-MAX_PAGE_COUNT = 51
+# Pages are streamed through a bounded window, so only conversion time (not
+# memory) grows with this; it applies to the selected page range
+MAX_PAGE_COUNT = int(os.environ.get("MAX_PAGE_COUNT", 5000))
 
-def validate_pdf(file_path):
+
+# ---------- PAGE RANGES ----------
+def parse_page_range(spec, page_count):
+    # "100-150", "7", "1-3,10-12" or "100-" (to the end), 1-based and
+    # inclusive -> sorted 0-based page numbers
+    pages = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        try:
+            start = int(first) if first else 1
+            stop = (int(last) if last else page_count) if dash else start
+        except ValueError:
+            raise ValueError(f"Invalid page range '{part}'")
+        if start < 1 or stop > page_count or start > stop:
+            raise ValueError(f"Page range '{part}' is outside the document (1-{page_count})")
+        pages.update(range(start - 1, stop))
+    if not pages:
+        raise ValueError("Empty page range")
+    return sorted(pages)
+
+
+def format_page_range(page_numbers):
+    # Inverse of parse_page_range, e.g. [99, 100, 101, 104] -> "100-102,105"
+    ranges = []
+    for page_num in page_numbers:
+        if ranges and page_num == ranges[-1][1] + 1:
+            ranges[-1][1] = page_num
+        else:
+            ranges.append([page_num, page_num])
+    return ",".join(f"{a + 1}" if a == b else f"{a + 1}-{b + 1}" for a, b in ranges)
+
+
+def open_validated_pdf(file_path, page_spec=None):
+    # Returns (open fitz document or None, 0-based page numbers, errors). The
+    # document has already been inspected, so a valid one is handed on to the
+    # conversion job as is instead of being parsed a second time.
     errors = []
+    page_numbers = None
 
     # File size check
     file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
@@ -13,23 +52,40 @@ def validate_pdf(file_path):
         errors.append(f"File size exceeds {MAX_FILE_SIZE_MB} MB")
 
     # Page count check
+    import fitz  # PyMuPDF
     try:
         doc = fitz.open(file_path)
-        if len(doc) > MAX_PAGE_COUNT:
+    except Exception as e:
+        errors.append(f"Failed to open PDF: {str(e)}")
+        return None, page_numbers, errors
+
+    try:
+        page_numbers = parse_page_range(page_spec, len(doc)) if page_spec else list(range(len(doc)))
+        if len(page_numbers) > MAX_PAGE_COUNT:
             errors.append(f"PDF has more than {MAX_PAGE_COUNT} pages")
 
         # Digital format check: look for any actual text
         is_digital = False
-        for page in doc:
-            text = page.get_text("text")
+        for page_num in page_numbers:
+            text = doc[page_num].get_text("text")
             if text.strip():
                 is_digital = True
                 break
         if not is_digital:
             errors.append("PDF appears to be scanned or image-based (no selectable text found)")
-
-        doc.close()
+    except ValueError as e:
+        errors.append(str(e))
     except Exception as e:
         errors.append(f"Failed to open PDF: {str(e)}")
 
+    if errors:
+        doc.close()
+        return None, page_numbers, errors
+    return doc, page_numbers, errors
+
+
+def validate_pdf(file_path):
+    doc, _, errors = open_validated_pdf(file_path)
+    if doc is not None:
+        doc.close()
     return errors
@@ -0,0 +1,442 @@
+import os
+import json
+import shutil
+import tempfile
+from html import escape
+from urllib.request import pathname2url
+from compression import precompress
+from model import page_to_model, page_from_model
+
+# CSS pixel width every page is laid out at (the app, batch runs and the
+# benchmark all convert at this width)
+TARGET_WIDTH = 960
+
+# Templates are str.format() strings split around the streamed part: the
+# page fragments. The original PDF is only referenced by URL (served with
+# Range support by the app), never embedded.
+COMPARE_HEAD = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>PDF to HTML Comparison</title>
+    <style>
+        {font_css}
+        body {{
+            font-family: Arial, sans-serif;
+            margin: 0;
+            padding: 0;
+            background: #f5f5f5;
+        }}
+        .header {{
+            padding: 15px;
+            background-color: #2c3e50;
+            color: white;
+            text-align: center;
+            font-size: 18px;
+            font-weight: bold;
+        }}
+        .info-bar {{
+            padding: 12px;
+            font-size: 14px;
+            background-color: #ecf0f1;
+            border-bottom: 1px solid #bdc3c7;
+            font-family: monospace;
+            text-align: center;
+        }}
+        .comparison-container {{
+            display: flex;
+            height: calc(100vh - 120px);
+        }}
+        .pdf-panel, .html-panel {{
+            width: 50%;
+            border: 2px solid #34495e;
+            overflow: auto;
+        }}
+        .panel-header {{
+            background-color: #34495e;
+            color: white;
+            padding: 10px;
+            text-align: center;
+            font-weight: bold;
+            position: sticky;
+            top: 0;
+            z-index: 100;
+        }}
+        .pdf-content {{
+            padding: 20px;
+            text-align: center;
+            background: white;
+        }}
+        .pdf-embed {{
+            width: 100%;
+            height: 800px;
+            border: none;
+        }}
+        .html-content {{
+            background: #eee;
+            min-height: 100%;
+        }}
+        .page-container {{
+            position: relative;
+            margin: 30px auto;
+            background: white;
+            border: 1px solid #ccc;
+            box-shadow: 0 0 10px rgba(0,0,0,0.1);
+            width: {target_width}px;
+        }}
+        .positioned-text {{
+            position: absolute;
+            white-space: pre;
+            text-decoration: none;
+        }}
+        .positioned-text a {{
+            color: blue;
+            text-decoration: underline;
+        }}
+        .positioned-image {{
+            position: absolute;
+            object-fit: contain;
+        }}
+        table {{
+            border-collapse: collapse;
+            width: 100%;
+            height: 100%;
+        }}
+        table td {{
+            border: 1px solid #000;
+            padding: 4px;
+            vertical-align: top;
+            font-size: 12px;
+        }}
+    </style>
+    <script>
+        const t0 = performance.now();
+        window.onload = () => {{
+            const t1 = performance.now();
+            document.getElementById("render-time").innerText = (t1 - t0).toFixed(2) + " ms";
+            const pdfPanel = document.querySelector('.pdf-panel');
+            const htmlPanel = document.querySelector('.html-panel');
+            let isScrollingPdf = false;
+            let isScrollingHtml = false;
+            pdfPanel.addEventListener('scroll', () => {{
+                if (isScrollingHtml) return;
+                isScrollingPdf = true;
+                const ratio = pdfPanel.scrollTop / (pdfPanel.scrollHeight - pdfPanel.clientHeight);
+                htmlPanel.scrollTop = ratio * (htmlPanel.scrollHeight - htmlPanel.clientHeight);
+                setTimeout(() => isScrollingPdf = false, 50);
+            }});
+            htmlPanel.addEventListener('scroll', () => {{
+                if (isScrollingPdf) return;
+                isScrollingHtml = true;
+                const ratio = htmlPanel.scrollTop / (htmlPanel.scrollHeight - htmlPanel.clientHeight);
+                pdfPanel.scrollTop = ratio * (pdfPanel.scrollHeight - pdfPanel.clientHeight);
+                setTimeout(() => isScrollingHtml = false, 50);
+            }});
+        }};
+    </script>
+</head>
+<body>
+    <div class="header">PDF to HTML Conversion Comparison</div>
+    <div class="info-bar">
+        <b>Conversion time:</b> <span id="conversion-time">...</span> seconds |
+        <b>Render time:</b> <span id="render-time">...</span> |
+        <b>Pages:</b> {total_pages}
+    </div>
+    <div class="comparison-container">
+        <div class="pdf-panel">
+            <div class="panel-header">Original PDF</div>
+            <div class="pdf-content">
+                <embed class="pdf-embed" src="{pdf_url}" type="application/pdf" />
+            </div>
+        </div>
+        <div class="html-panel">
+            <div class="panel-header">Converted HTML</div>
+            <div class="html-content">
+"""
+
+COMPARE_TAIL = """            </div>
+        </div>
+    </div>
+    <script>
+        document.getElementById("conversion-time").innerText = "{conversion_time}";
+    </script>
+</body>
+</html>
+"""
+
+CLEAN_HEAD = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Converted PDF (Clean)</title>
+    <style>
+        {font_css}
+        body {{
+            font-family: Arial, sans-serif;
+            margin: 0;
+            padding: 20px;
+            background: #f5f5f5;
+        }}
+        .page-container {{
+            position: relative;
+            margin: 30px auto;
+            background: white;
+            border: 1px solid #ccc;
+            box-shadow: 0 0 10px rgba(0,0,0,0.1);
+            width: {target_width}px;
+        }}
+        .positioned-text {{
+            position: absolute;
+            white-space: pre;
+            text-decoration: none;
+        }}
+        .positioned-text a {{
+            color: blue;
+            text-decoration: underline;
+        }}
+        .positioned-image {{
+            position: absolute;
+            object-fit: contain;
+        }}
+        table {{
+            border-collapse: collapse;
+            width: 100%;
+            height: 100%;
+        }}
+        table td {{
+            border: 1px solid #000;
+            padding: 4px;
+            vertical-align: top;
+            font-size: 12px;
+        }}
+    </style>
+</head>
+<body>
+"""
+
+CLEAN_TAIL = """</body>
+</html>
+"""
+
+
+# ---------- PER-PAGE FRAGMENTS ----------
+PAGE_MANIFEST = "manifest.json"
+PAGE_FONT_CSS = "fonts.css"
+# Marks a job whose pages were edited after the documents were assembled
+STALE_MARKER = "stale"
+
+
+def page_file_name(page_number):
+    return f"page-{page_number}.html"
+
+
+def page_model_name(page_number):
+    # The stored page model (model.page_to_model), so an edit can re-render
+    # one page without parsing HTML
+    return f"page-{page_number}.model.json"
+
+
+def write_text_atomic(path, text):
+    # Readers poll for page files while the job runs; never show a partial one
+    write_bytes_atomic(path, text.encode("utf-8"))
+
+
+def write_bytes_atomic(path, data):
+    # Write then rename, through a unique temporary name so concurrent
+    # writers of the same file (jobs sharing fonts, assets or pages) never
+    # serve or clobber a partial one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def page_files(pages_dir):
+    # {file name: path} of everything published for a job's pages
+    return {name: os.path.join(pages_dir, name) for name in os.listdir(pages_dir) if not name.endswith(".tmp")}
+
+
+def save_page(pages_dir, page, compact_html):
+    page_html = page.to_html(compact=compact_html)
+    write_text_atomic(os.path.join(pages_dir, page_model_name(page.number)),
+                      json.dumps(page_to_model(page), separators=(",", ":"), ensure_ascii=False))
+    page_path = os.path.join(pages_dir, page_file_name(page.number))
+    write_text_atomic(page_path, page_html)
+    precompress(page_path)
+    return page_html
+
+
+def load_page(pages_dir, page_number):
+    with open(os.path.join(pages_dir, page_model_name(page_number)), encoding="utf-8") as f:
+        return page_from_model(json.load(f))
+
+
+def read_manifest(pages_dir):
+    with open(os.path.join(pages_dir, PAGE_MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def manifest_page_numbers(manifest):
+    # 1-based source page numbers; a page-range job keeps the original
+    # numbering, so page 120 is still page-120.html
+    return manifest.get("page_numbers") or list(range(1, manifest["total_pages"] + 1))
+
+
+# ---------- DOCUMENT ASSEMBLY ----------
+# The JSON document keeps the layout json.dump(indent=4) gives
+# {"document": {"pages": [...]}} unless compact
+def json_head(compact):
+    return '{"document":{"pages":[' if compact else '{\n    "document": {\n        "pages": ['
+
+
+def json_page_entry(page, first, compact):
+    separator = "" if first else ","
+    if compact:
+        return separator + json.dumps(page.to_json(), separators=(",", ":"), ensure_ascii=False)
+    page_json = json.dumps(page.to_json(), indent=4, ensure_ascii=False).replace("\n", "\n" + " " * 12)
+    return separator + "\n" + " " * 12 + page_json
+
+
+def json_tail(page_count, compact):
+    if compact:
+        return "]}}"
+    return "\n        ]\n    }\n}" if page_count else "]\n    }\n}"
+
+
+def relative_file_url(path, start):
+    # PDF URL for documents opened straight from disk (batch runs)
+    return pathname2url(os.path.relpath(path, start))
+
+
+def write_html_documents(html_path, compare_path, pdf_url, fields, conversion_time, copy_pages):
+    # copy_pages(out) writes every page fragment, in order, to `out`.
+    # Either path may be None to skip that document.
+    if html_path is not None:
+        with open(html_path, "w", encoding="utf-8") as out:
+            out.write(CLEAN_HEAD.format(**fields))
+            copy_pages(out)
+            out.write(CLEAN_TAIL)
+
+    if compare_path is None:
+        return
+    with open(compare_path, "w", encoding="utf-8") as out:
+        out.write(COMPARE_HEAD.format(pdf_url=escape(pdf_url), **fields))
+        copy_pages(out)
+        out.write(COMPARE_TAIL.format(conversion_time=conversion_time))
+
+
+def assemble_documents(pages_dir, html_path, compare_path, json_path, pdf_url, compact_json=False):
+    # Rebuild the whole-document files from the per-page files after edits.
+    # Only concatenation and serialization: no HTML is parsed. Paths that
+    # are None are skipped (a cache hit only needs its own comparison page).
+    manifest = read_manifest(pages_dir)
+    with open(os.path.join(pages_dir, PAGE_FONT_CSS), encoding="utf-8") as f:
+        font_css = f.read()
+    page_numbers = manifest_page_numbers(manifest)
+
+    def copy_pages(out):
+        for page_number in page_numbers:
+            with open(os.path.join(pages_dir, page_file_name(page_number)), encoding="utf-8") as page_file:
+                shutil.copyfileobj(page_file, out)
+
+    fields = {"font_css": font_css, "target_width": manifest["target_width"],
+              "total_pages": manifest["total_pages"]}
+    write_html_documents(html_path, compare_path, pdf_url, fields, manifest.get("conversion_time", ""),
+                         copy_pages)
+    if json_path is None:
+        return
+    with open(json_path, "w", encoding="utf-8") as out:
+        out.write(json_head(compact_json))
+        for i, page_number in enumerate(page_numbers):
+            out.write(json_page_entry(load_page(pages_dir, page_number), i == 0, compact_json))
+        out.write(json_tail(len(page_numbers), compact_json))
+    stale_path = os.path.join(pages_dir, STALE_MARKER)
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
+
+
+# ---------- STREAMING DOCUMENT WRITER ----------
+class DocumentWriter:
+    # Streams each Page to disk as it arrives, so no output is ever held as
+    # one big string. Page HTML is spooled to a temporary file and the clean
+    # and comparison pages are assembled from it in close(), once the font
+    # CSS (which depends on every page's characters) is known.
+    # compact_json drops indent=4 for smaller, faster JSON; compact_html
+    # writes shared style classes instead of per-span inline styles.
+    # compare_path and pages_dir may be None (batch runs skip both).
+    # page_numbers lists the 1-based source pages of a page-range job.
+
+    def __init__(self, html_path, compare_path, json_path, pdf_url, target_width, total_pages,
+                 pages_dir, page_heights, compact_json=False, compact_html=False, page_numbers=None):
+        self.html_path = html_path
+        self.compare_path = compare_path
+        self.json_path = json_path
+        self.pdf_url = pdf_url
+        self.target_width = target_width
+        self.total_pages = total_pages
+        self.compact_json = compact_json
+        self.compact_html = compact_html
+        self.page_count = 0
+        # Each page is also published on its own under pages_dir as soon as it
+        # is written, for the lazy viewer; manifest.json lets it lay out
+        # placeholders for pages that do not exist yet
+        self.pages_dir = pages_dir
+        self.manifest = {
+            "total_pages": total_pages,
+            "target_width": target_width,
+            "page_heights": page_heights,
+            "compact_html": compact_html
+        }
+        if page_numbers:
+            self.manifest["page_numbers"] = page_numbers
+        if pages_dir:
+            os.makedirs(pages_dir, exist_ok=True)
+            write_text_atomic(os.path.join(pages_dir, PAGE_MANIFEST), json.dumps(self.manifest))
+        self._spool_path = html_path + ".pages.tmp"
+        self._spool = open(self._spool_path, "w+", encoding="utf-8")
+        self._json = open(json_path, "w", encoding="utf-8")
+        self._json.write(json_head(compact_json))
+
+    def write_page(self, page):
+        if self.pages_dir:
+            self._spool.write(save_page(self.pages_dir, page, self.compact_html))
+        else:
+            self._spool.write(page.to_html(compact=self.compact_html))
+        self._json.write(json_page_entry(page, self.page_count == 0, self.compact_json))
+        self.page_count += 1
+
+    def _copy_pages(self, out):
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, out)
+
+    def close(self, conversion_time, font_css):
+        self._json.write(json_tail(self.page_count, self.compact_json))
+        self._json.close()
+
+        if self.pages_dir:
+            write_text_atomic(os.path.join(self.pages_dir, PAGE_FONT_CSS), font_css)
+            precompress(os.path.join(self.pages_dir, PAGE_FONT_CSS))
+            self.manifest["conversion_time"] = conversion_time
+            write_text_atomic(os.path.join(self.pages_dir, PAGE_MANIFEST), json.dumps(self.manifest))
+
+        fields = {"font_css": font_css, "target_width": self.target_width, "total_pages": self.total_pages}
+        write_html_documents(self.html_path, self.compare_path, self.pdf_url, fields, conversion_time,
+                             self._copy_pages)
+        self._release()
+
+    def _release(self):
+        self._json.close()
+        self._spool.close()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+    def abort(self):
+        # A failed job keeps no half-written documents or pages around
+        self._release()
+        if os.path.exists(self.json_path):
+            os.remove(self.json_path)
+        if self.pages_dir:
+            shutil.rmtree(self.pages_dir, ignore_errors=True)